@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+# Time the data generators & charts of the helpers and the conversion of the notebooks
+# use:  python benchmarks/run_benchmarks.py
+# more: python benchmarks/run_benchmarks.py --help
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from glob import glob
+from datetime import datetime
+from statistics import median
+from timeit import default_timer
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+import altair as alt
+
+import make_slides
+from helpers import cards, distributions, pracical_basics, binomial, find_nice_coin_examples
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+REPEAT      = 3 # timings per benchmark, the median is reported
+INPUT_GLOB  = '*.ipynb'
+CONVERT     = True # also time the conversion of the notebooks to slides
+# statements timed in a fresh interpreter each
+IMPORTS     = (
+    'import helpers',
+    'import helpers.plotting',
+    'from helpers.cards import *',
+    'import helpers.distributions',
+    'import helpers.pracical_basics',
+    'import helpers.binomial',
+    'import helpers.find_nice_coin_examples',
+    'import make_slides',
+)
+
+
+# benchmarks
+# ==========
+def data_benchmarks():
+    "Yield name, parameters and function of each data generator benchmark"
+    for n_repeats in (10, 100, 1000):
+        for n_cards in (100, 1000):
+            params = dict(p_win_1=.5, p_win_2=.38, n_cards=n_cards, n_repeats=n_repeats)
+            if n_repeats * n_cards <= 100000:
+                # legacy seeds reseed for each experiment and are too slow for the big grid
+                yield 'repeated_experiments_df', dict(params, legacy_seeds=True), cards.repeated_experiments_df
+            yield 'repeated_experiments_df', dict(params, legacy_seeds=False), cards.repeated_experiments_df
+            yield 'summarize_experiments', params, cards.summarize_experiments
+    for n_cards in (100, 1000):
+        yield 'stack_comparison_df', dict(p_win_1=.5, p_win_2=.38, n_cards=n_cards), binomial.stack_comparison_df
+    for n_max in (7, 30, 100):
+        yield 'sum_of_n_dice_df', dict(n_max=n_max), distributions.sum_of_n_dice_df
+    for max_coins in (8, 14, 20):
+        yield 'find_coins', dict(min_coins=3, max_coins=max_coins, verbose=False), find_nice_coin_examples.find_coins
+    for n_replicates in (10**4, 10**5):
+        yield 'simulate_sample_statistics', dict(
+            population=normal_population, sample_sizes=[5, 20, 100], n_replicates=n_replicates
+        ), pracical_basics.simulate_sample_statistics
+
+
+def normal_population(rng, shape):
+    return rng.normal(0, 1, shape)
+
+
+def chart_benchmarks():
+    "Yield name, parameters and function building & displaying the charts of each chart benchmark"
+    n_cards, n_repeats = 100, 50
+    data = cards.repeated_experiments_df(.5, .38, n_cards, n_repeats)
+    summary, histogram = cards.summarize_experiments(.5, .38, n_cards, 1000)
+    yield 'plot_first_experiment_bars', {}, lambda: cards.plot_first_experiment_bars(
+        make_slides_datasource(data), n_cards
+    ).display()
+    yield 'plot_first_experiment_lines', {}, lambda: cards.plot_first_experiment_lines(
+        make_slides_datasource(data)
+    )
+    for aggregated in (False, True):
+        chart_data = cards.cumulative_wins_df(data) if aggregated else data
+        yield 'plot_repeated_experiments', dict(aggregated=aggregated), (
+            lambda chart_data=chart_data, aggregated=aggregated: cards.plot_repeated_experiments(
+                make_slides_datasource(chart_data), n_cards, aggregated=aggregated
+            )
+        )
+        yield 'plot_experiment_bars_with_errors', dict(aggregated=aggregated), (
+            lambda chart_data=chart_data, aggregated=aggregated: cards.plot_experiment_bars_with_errors(
+                make_slides_datasource(chart_data), n_cards, 10, n_repeats, aggregated=aggregated
+            )
+        )
+    yield 'plot_experiment_summary', {}, lambda: cards.plot_experiment_summary(summary, histogram, n_cards)
+    yield 'plot_p_win_distribution', {}, lambda: binomial.plot_p_win_distribution(.5, .38, n_cards)
+    for n_max in (7, 30):
+        yield 'plot_sum_of_n_dice', dict(n_max=n_max), lambda n_max=n_max: distributions.plot_sum_of_n_dice(n_max)
+    for precomputed in (False, True):
+        yield 'plot_population_vs_sample_mean', dict(precomputed=precomputed), (
+            lambda precomputed=precomputed: pracical_basics.plot_population_vs_sample_mean(precomputed=precomputed)
+        )
+
+
+def make_slides_datasource(df):
+    "Like the notebooks, pass data through df_to_datasource first"
+    from helpers.plotting import df_to_datasource
+    return df_to_datasource(df)
+
+
+# measurements
+# ============
+def measure(func, kwargs={}, repeat=REPEAT):
+    """Return median wall time over repeat calls and the peak memory allocated by one call.
+    Peak memory is measured in a separate call, because tracing slows down numpy & pandas.
+    """
+    times = []
+    for _ in range(repeat):
+        start = default_timer()
+        func(**kwargs)
+        times.append(default_timer() - start)
+    tracemalloc.start()
+    try:
+        func(**kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': median(times), 'peak_memory_bytes': peak}
+
+
+def measure_charts(func, export_dir, repeat=REPEAT):
+    """Measure func like measure, and the size of the charts it displays in the slides:
+    the serialized spec and the embedded & linked (exported) data.
+    """
+    charts = []
+    def display(self, *args, **kwargs):
+        charts.append(self.to_dict())
+    with mock.patch.object(alt.TopLevelMixin, 'display', display):
+        result = measure(func, repeat=repeat)
+    spec = charts[-1]
+    embedded, linked = 0, 0
+    for kind, data in make_slides.chart_data(spec):
+        if kind == 'embedded':
+            embedded += len(json.dumps(data))
+        else:
+            linked += os.path.getsize(os.path.join(export_dir, data))
+    result.update({
+        'spec_bytes':          len(json.dumps(spec)),
+        'embedded_data_bytes': embedded,
+        'linked_data_bytes':   linked,
+    })
+    return result
+
+
+def measure_import(statement, repeat=REPEAT):
+    "Return median wall time of statement in a new python process, i.e. with nothing imported yet"
+    code = (
+        "from timeit import default_timer\n"
+        "start = default_timer()\n"
+        f"{statement}\n"
+        "print(default_timer() - start)"
+    )
+    times = []
+    for _ in range(repeat):
+        sp = subprocess.run(
+            [sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True
+        )
+        times.append(float(sp.stdout.strip().splitlines()[-1]))
+    return {'seconds': median(times)}
+
+
+def measure_conversion(notebook_filename, output_dir):
+    "Return wall time of converting the notebook to slides, without the build cache"
+    start = default_timer()
+    sp = make_slides.convert_notebook(notebook_filename, output_dir, verbose=False)
+    seconds = default_timer() - start
+    slides = os.path.join(output_dir, make_slides.slides_filename(notebook_filename))
+    return {
+        'seconds':     seconds,
+        'returncode':  sp.returncode,
+        'slides_bytes': os.path.getsize(slides) if os.path.exists(slides) else None,
+    }
+
+
+def environment():
+    "Versions & commit the benchmarks ran with"
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except FileNotFoundError:
+        commit = None
+    return {
+        'commit':   commit,
+        'python':   platform.python_version(),
+        'machine':  platform.machine(),
+        'cpus':     os.cpu_count(),
+        'numpy':    np.__version__,
+        'pandas':   pd.__version__,
+        'altair':   alt.__version__,
+    }
+
+
+def jsonable(params):
+    "Parameters as they are stored in the results, e.g. functions by name"
+    return {k: getattr(v, '__name__', v) for k, v in params.items()}
+
+
+def run(input_glob=INPUT_GLOB, convert=CONVERT, repeat=REPEAT, name_filter=''):
+    """Run all benchmarks whose name contains name_filter and return the results.
+    The disk cache of the helpers (helpers.memoize) is disabled, so the generators actually run.
+    """
+    results = []
+    def report(kind, name, params, measurement, *args):
+        "Run the measurement, a failing benchmark is recorded with its error"
+        try:
+            result = measurement(*args)
+        except Exception as e:
+            result = {'seconds': None, 'error': repr(e)}
+            print(f"{name} {jsonable(params)}: failed with {e!r}")
+        else:
+            print(f"{name} {jsonable(params)}: {result['seconds']:.3f} s")
+        results.append({'kind': kind, 'name': name, 'params': jsonable(params), **result})
+
+    for statement in IMPORTS:
+        if name_filter in statement:
+            report('import', statement, {}, measure_import, statement, repeat)
+
+    with mock.patch.dict(os.environ, {'HELPERS_CACHE': 'FALSE'}):
+        for name, params, func in data_benchmarks():
+            if name_filter in name:
+                report('data', name, params, measure, func, params, repeat)
+
+        # charts are exported like in the slides
+        export_dir = tempfile.mkdtemp()
+        try:
+            with mock.patch.dict(os.environ, {'CONVERT': 'TRUE', 'EXPORT_DIR': export_dir}):
+                for name, params, func in chart_benchmarks():
+                    if name_filter in name:
+                        report('chart', name, params, measure_charts, func, export_dir, repeat)
+            if convert:
+                for filename in sorted(glob(os.path.join(ROOT, input_glob))):
+                    name = os.path.basename(filename)
+                    if name_filter in name:
+                        report('conversion', name, {}, measure_conversion, filename, export_dir)
+        finally:
+            shutil.rmtree(export_dir)
+    return results
+
+
+def compare(results, baseline_filename):
+    "Print the ratio of the times in results to the times in a previous results file"
+    with open(baseline_filename, 'r') as f:
+        baseline = {
+            (r['kind'], r['name'], json.dumps(r['params'], sort_keys=True)): r
+            for r in json.load(f)['results']
+        }
+    print(f"\ncompared to {baseline_filename}:")
+    for r in results:
+        previous = baseline.get((r['kind'], r['name'], json.dumps(r['params'], sort_keys=True)))
+        if r['seconds'] and previous is not None and previous['seconds']:
+            print(f"{r['name']} {r['params']}: {r['seconds'] / previous['seconds']:.2f}x time")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the helpers & the notebook conversion')
+    parser.add_argument(
+        '--filter',
+        default='',
+        help='Only run benchmarks whose name contains this string'
+    )
+    parser.add_argument(
+        '--repeat',
+        default=REPEAT,
+        type=int,
+        help=f'Number of timings per benchmark (default: {REPEAT})'
+    )
+    parser.add_argument(
+        '--convert',
+        default=CONVERT,
+        type=make_slides.str2bool,
+        help=f'Also time the conversion of the notebooks to slides (default: {CONVERT})'
+    )
+    parser.add_argument(
+        '--input_glob',
+        default=INPUT_GLOB,
+        help=f'Notebooks to convert (default: {INPUT_GLOB})'
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        help=f'JSON file for the results (default: {RESULTS_DIR}/<date>_<time>.json)'
+    )
+    parser.add_argument(
+        '--compare',
+        default=None,
+        help='JSON file of a previous run to compare with'
+    )
+    args = parser.parse_args()
+
+    started = datetime.now()
+    results = run(args.input_glob, args.convert, args.repeat, args.filter)
+    output  = args.output or os.path.join(RESULTS_DIR, started.strftime('%Y-%m-%d_%H-%M-%S.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(
+            {'started': started.isoformat(), 'environment': environment(), 'results': results},
+            f, indent=1
+        )
+    print(f"results written to {output}")
+    if args.compare is not None:
+        compare(results, args.compare)
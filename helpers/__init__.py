@@ -1 +1,26 @@
-"""Helpers used by one or more notebooks"""
\ No newline at end of file
+"""Helpers used by one or more notebooks"""
+import sys
+import importlib
+import importlib.util
+
+
+def lazy_import(name):
+    """Return module name, but only import it when one of its attributes is used.
+    Keeps importing the helpers fast, e.g. for the command line tools that don't plot anything.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def __getattr__(name):
+    "Import submodules on first use, e.g. helpers.cards after import helpers"
+    if importlib.util.find_spec(f'{__name__}.{name}') is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return importlib.import_module(f'{__name__}.{name}')
@@ -0,0 +1,148 @@
+"""Exact results for the card experiment,
+the number of wins after drawing n cards from a stack follows a binomial distribution."""
+import numpy as np
+
+from . import lazy_import
+from .plotting import df_to_datasource
+
+alt = lazy_import('altair')
+pd  = lazy_import('pandas')
+
+# probabilities
+# =============
+def log_factorials(n_max):
+    "log(k!) for k = 0 ... n_max"
+    return np.concatenate([[0.], np.cumsum(np.log(np.arange(1, n_max+1)))])
+
+
+def binomial_pmf(n, p):
+    """Probability of k wins after n cards with winning probability p, for each n in n.
+    Returns an array of shape (len(n), max(n)+1), row i is zero for k > n[i].
+    """
+    n = np.atleast_1d(n)[:, np.newaxis]
+    k = np.arange(n.max() + 1)
+    log_factorial = log_factorials(n.max())
+    possible = k <= n
+    n_minus_k = np.where(possible, n - k, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 0 * log(0) is 0 here
+        log_pmf = (
+            log_factorial[n] - log_factorial[k] - log_factorial[n_minus_k]
+            + np.where(k > 0, k * np.log(p), 0.)
+            + np.where(n_minus_k > 0, n_minus_k * np.log1p(-p), 0.)
+        )
+    return np.where(possible, np.exp(log_pmf), 0.)
+
+
+def p_win_distribution_df(p_win_1, p_win_2, n_cards, min_probability=0):
+    """Exact distribution of the observed winning probability of each stack after each card_pair.
+    One row per stack, card_pair, and number of wins. Rows with probability < min_probability are left out.
+    """
+    card_pairs = np.arange(1, n_cards+1)
+    res = []
+    for stack, p_win in ((1, p_win_1), (2, p_win_2)):
+        pmf = binomial_pmf(card_pairs, p_win)
+        card_pair_index, wins = np.nonzero(pmf >= max(min_probability, np.finfo(float).tiny))
+        res.append(pd.DataFrame({
+            'stack':       stack,
+            'card_pair':   card_pairs[card_pair_index],
+            'wins':        wins,
+            'p_win':       wins / card_pairs[card_pair_index],
+            'probability': pmf[card_pair_index, wins],
+        }))
+    return pd.concat(res, ignore_index=True)
+
+
+def p_win_moments_df(p_win_1, p_win_2, n_cards):
+    """Exact mean & standard deviation of the observed winning probability of each stack
+    after each card_pair, i.e. p and sqrt(p * (1 - p) / n).
+    """
+    card_pairs = np.arange(1, n_cards+1)
+    return pd.DataFrame({
+        'stack':      np.repeat([1, 2], n_cards),
+        'card_pair':  np.tile(card_pairs, 2),
+        'p_win_mean': np.repeat([p_win_1, p_win_2], n_cards).astype(float),
+        'p_win_std':  np.sqrt(
+            np.repeat([p_win_1 * (1 - p_win_1), p_win_2 * (1 - p_win_2)], n_cards) / np.tile(card_pairs, 2)
+        ),
+    })
+
+
+def stack_comparison_df(p_win_1, p_win_2, n_cards):
+    """Exact probabilities that stack 1 has more, as many, or fewer wins than stack 2
+    after each card_pair (cards from the two stacks are independent).
+    """
+    card_pairs = np.arange(1, n_cards+1)
+    pmf_1 = binomial_pmf(card_pairs, p_win_1)
+    pmf_2 = binomial_pmf(card_pairs, p_win_2)
+    # probability that stack 2 has fewer than k wins
+    fewer_2 = np.cumsum(pmf_2, axis=1) - pmf_2
+    p_stack_1_better = np.sum(pmf_1 * fewer_2, axis=1)
+    p_tie = np.sum(pmf_1 * pmf_2, axis=1)
+    return pd.DataFrame({
+        'card_pair':        card_pairs,
+        'p_stack_1_better': p_stack_1_better,
+        'p_tie':            p_tie,
+        'p_stack_2_better': np.clip(1 - p_stack_1_better - p_tie, 0, 1),
+    })
+
+
+# plot
+# ====
+def plot_p_win_distribution(p_win_1, p_win_2, n_card_pairs, min_probability=1e-4):
+    """Plot the exact distribution of the observed winning probabilities after a selectable number of
+    card pairs, and the probability that stack 1 wins more often than stack 2.
+    No simulation necessary, compare with plot_repeated_experiments.
+    """
+    input_n_cards = alt.binding(
+        input='range',
+        min=1,
+        max=n_card_pairs,
+        step=1,
+        name='Card pairs per Experiment: '
+    )
+    selection = alt.selection_single(
+        bind=input_n_cards,
+        init={'card_pair': min(25, n_card_pairs)}
+    )
+    card_pair_filter = (
+        alt.expr.toNumber(alt.datum.card_pair) == alt.expr.toNumber(selection.card_pair)
+    )
+
+    distribution = alt.Chart(
+        df_to_datasource(
+            p_win_distribution_df(p_win_1, p_win_2, n_card_pairs, min_probability),
+            embed_in_notebook=True
+        )
+    ).mark_bar(opacity=.66, size=4).encode(
+        x=alt.X('p_win:Q', scale=alt.Scale(domain=[0,1]), title='Winning probability'),
+        y=alt.Y('probability:Q', stack=None, title='Probability'),
+        color=alt.Color('stack:N', legend=alt.Legend(title='Stack')),
+    ).add_selection(
+        selection
+    ).transform_filter(
+        card_pair_filter
+    ).properties(
+        width=400,
+        height=200
+    )
+
+    comparison = alt.Chart(
+        df_to_datasource(stack_comparison_df(p_win_1, p_win_2, n_card_pairs), embed_in_notebook=True)
+    ).mark_text(align='left', baseline='middle').encode(
+        x=alt.value(0),
+        text='label:N'
+    ).transform_filter(
+        card_pair_filter
+    ).transform_calculate(
+        label='"Probability that stack 1 wins more often: " + format(datum.p_stack_1_better, ".1%")'
+    ).properties(
+        width=400,
+        height=20
+    )
+
+    alt.vconcat(distribution, comparison).configure_axis(
+        grid=False
+    ).configure_view(
+        strokeWidth=0
+    ).display(renderer='svg')
@@ -1,9 +1,14 @@
 """Helpers for the card experiment notebook"""
-import altair as alt
 import numpy as np
-import pandas as pd
 import os
 
+from . import lazy_import
+from .plotting import precompute_transforms, df_to_datasource
+from .memoize import memoize
+
+alt = lazy_import('altair')
+pd  = lazy_import('pandas')
+
 # numerical experiment
 # ====================
 def draw_cards(p_win_1, p_win_2, n_cards, seed=None):
@@ -13,20 +18,166 @@ def draw_cards(p_win_1, p_win_2, n_cards, seed=None):
     return np.random.binomial(1, (p_win_1, p_win_2), size=(n_cards, 2)).T
 
 
-def repeated_experiments_df(p_win_1, p_win_2, n_cards, n_repeats, seed=0):
-    res = []
+def draw_experiments(p_win_1, p_win_2, n_cards, n_repeats, seed=0, legacy_seeds=False):
+    """Draw the cards for all experiments into one array of shape (n_repeats, n_cards, 2).
     
-    for i in range(n_repeats):
-        wins = draw_cards(p_win_1, p_win_2, n_cards, seed=seed+i*n_cards*2)
-        res.append(
-            pd.DataFrame({
-                'experiment': i+1,
-                'stack':      [1] * n_cards + [2] * n_cards,
-                'card_pair':  np.tile(np.arange(1, n_cards+1), 2),
-                'win':        np.concatenate(wins)
-            })
-        )
-    return pd.concat(res)
+    By default, all experiments are drawn from one random generator seeded with seed, 
+    in chunks (see iter_experiments). More repeats only append experiments, but the cards 
+    of experiment i depend on n_cards.
+    legacy_seeds=True instead reseeds with seed + i*n_cards*2 like draw_cards, which
+    reproduces the results of earlier versions exactly but is much slower.
+    """
+    wins = np.empty((n_repeats, n_cards, 2), dtype=np.int8)
+    if legacy_seeds:
+        for i in range(n_repeats):
+            # same draws as draw_cards, without touching the global random state
+            wins[i] = np.random.RandomState(seed + i*n_cards*2).binomial(
+                1, (p_win_1, p_win_2), size=(n_cards, 2)
+            )
+    else:
+        start = 0
+        for chunk in iter_experiments(p_win_1, p_win_2, n_cards, n_repeats, seed=seed):
+            wins[start:start+len(chunk)] = chunk
+            start += len(chunk)
+    return wins
+
+
+def iter_experiments(p_win_1, p_win_2, n_cards, n_repeats, chunk_size=1000, seed=0):
+    """Yield the cards of n_repeats experiments in arrays of shape (chunk_size, n_cards, 2).
+    The last chunk may be smaller. Together, the chunks are the same as 
+    draw_experiments(p_win_1, p_win_2, n_cards, n_repeats, seed), but only one chunk is kept in memory.
+    """
+    # a generator returns the same numbers whether they are drawn at once or in chunks
+    rng = np.random.default_rng(seed)
+    p_win = np.array([p_win_1, p_win_2])
+    for start in range(0, n_repeats, chunk_size):
+        yield (rng.random((min(chunk_size, n_repeats - start), n_cards, 2)) < p_win).astype(np.int8)
+
+
+def chunk_statistics(values):
+    "Return count, mean, and sum of squared deviations along the first axis"
+    mean = values.mean(axis=0)
+    return len(values), mean, ((values - mean)**2).sum(axis=0)
+
+
+def merge_statistics(a, b):
+    """Merge count, mean, and sum of squared deviations of two chunks 
+    with the parallel variance algorithm by Chan, Golub & LeVeque.
+    """
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta**2 * n_a * n_b / n
+
+
+def summarize_experiments(
+        p_win_1, p_win_2, n_cards, n_repeats, chunk_size=1000, seed=0, n_bins=10
+    ):
+    """Simulate the card experiment n_repeats times in chunks (see iter_experiments)
+    and return only the summaries the charts need, so memory doesn't grow with n_repeats.
+    
+    Returns two DataFrames with one row per stack and card_pair (number of card pairs drawn so far):
+    
+    - summary: experiments, p_win_mean and p_win_std (ddof=1) of the winning probabilities over experiments
+    - histogram: in addition bin_start, bin_end and the number of experiments with p_win in each of 
+      n_bins equal bins from 0 to 1 (the last one includes 1)
+    """
+    n_drawn = np.arange(1, n_cards+1)[:, np.newaxis]
+    statistics = None
+    counts = np.zeros((n_cards, 2, n_bins), dtype=np.int64)
+    for wins in iter_experiments(p_win_1, p_win_2, n_cards, n_repeats, chunk_size, seed):
+        # running winning probability of each experiment after each card pair
+        p_win = wins.cumsum(axis=1, dtype=np.int32) / n_drawn
+        chunk = chunk_statistics(p_win)
+        statistics = chunk if statistics is None else merge_statistics(statistics, chunk)
+        bins = np.minimum((p_win * n_bins).astype(np.int64), n_bins - 1)
+        counts += np.bincount(
+            (np.arange(n_cards * 2).reshape(n_cards, 2) * n_bins + bins).ravel(),
+            minlength=counts.size
+        ).reshape(counts.shape)
+    n, mean, m2 = statistics
+    
+    # rows ordered by stack, then card_pair
+    stack     = np.repeat([1, 2], n_cards)
+    card_pair = np.tile(n_drawn[:, 0], 2)
+    summary = pd.DataFrame({
+        'stack':       stack,
+        'card_pair':   card_pair,
+        'experiments': n,
+        'p_win_mean':  mean.T.ravel(),
+        'p_win_std':   np.sqrt(m2 / max(n - 1, 1)).T.ravel(),
+    })
+    histogram = pd.DataFrame({
+        'stack':       np.repeat(stack, n_bins),
+        'card_pair':   np.repeat(card_pair, n_bins),
+        'bin_start':   np.tile(np.arange(n_bins) / n_bins, 2 * n_cards),
+        'bin_end':     np.tile(np.arange(1, n_bins + 1) / n_bins, 2 * n_cards),
+        'experiments': counts.transpose(1, 0, 2).ravel(),
+    })
+    return summary, histogram[histogram['experiments'] > 0].reset_index(drop=True)
+
+
+def experiments_to_df(wins):
+    """Convert an array of shape (n_repeats, n_cards, 2) to the long format used by the charts.
+    One row per experiment, stack, and card_pair.
+    """
+    n_repeats, n_cards, n_stacks = wins.shape
+    rows_per_experiment = n_stacks * n_cards
+    return pd.DataFrame(
+        {
+            'experiment': np.repeat(np.arange(1, n_repeats+1), rows_per_experiment),
+            'stack':      np.tile(np.repeat(np.arange(1, n_stacks+1), n_cards), n_repeats),
+            'card_pair':  np.tile(np.arange(1, n_cards+1), n_stacks * n_repeats),
+            # all cards of stack 1 before all cards of stack 2 within each experiment
+            'win':        wins.transpose(0, 2, 1).ravel().astype(np.int64),
+        },
+        # row numbers restart for each experiment, like concatenating one frame per experiment
+        index=np.tile(np.arange(rows_per_experiment), n_repeats)
+    )
+
+
+@memoize
+def repeated_experiments_df(p_win_1, p_win_2, n_cards, n_repeats, seed=0, legacy_seeds=True):
+    """Repeat the card experiment n_repeats times and return the results in long format.
+    
+    legacy_seeds=True (default) gives the same results as earlier versions, 
+    legacy_seeds=False is much faster for many repeats. See draw_experiments.
+    """
+    return experiments_to_df(
+        draw_experiments(p_win_1, p_win_2, n_cards, n_repeats, seed=seed, legacy_seeds=legacy_seeds)
+    )
+    
+
+def cumulative_wins_df(data, decimals=4):
+    """Precompute the running statistics of each experiment from the long format data.
+    
+    Returns one row per experiment, stack, and card_pair, where card_pair is the number of
+    card pairs drawn so far. wins is the running number of wins, p_win the running mean, 
+    and p_win_se its standard error (undefined after a single card), rounded to decimals.
+    The charts only need to filter this table instead of aggregating the raw wins.
+    """
+    data = data.sort_values(['experiment', 'stack', 'card_pair'])
+    experiments = data['experiment'].unique()
+    stacks      = data['stack'].unique()
+    n_cards     = len(data) // (len(experiments) * len(stacks))
+    
+    wins    = data['win'].to_numpy().reshape(len(experiments), len(stacks), n_cards)
+    n_drawn = np.arange(1, n_cards+1)
+    cumulative_wins = wins.cumsum(axis=2)
+    p_win = cumulative_wins / n_drawn
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # sample std with ddof=1 of 0/1 values is sqrt(n/(n-1) * p*(1-p))
+        p_win_se = np.sqrt(p_win * (1 - p_win) / (n_drawn - 1))
+        
+    return pd.DataFrame({
+        'experiment': np.repeat(experiments, len(stacks) * n_cards),
+        'stack':      np.tile(np.repeat(stacks, n_cards), len(experiments)),
+        'card_pair':  np.tile(n_drawn, len(experiments) * len(stacks)),
+        'wins':       cumulative_wins.ravel(),
+        'p_win':      p_win.ravel().round(decimals),
+        'p_win_se':   p_win_se.ravel().round(decimals),
+    })
     
 
 # plotting
@@ -48,7 +199,7 @@ def plot_first_experiment_bars(data, n_card_pairs):
     )
 
     # filter data & plot bar chart
-    return alt.Chart(data).mark_bar().encode(
+    chart = alt.Chart(data).mark_bar().encode(
         alt.X('stack:N', title='Card Stack'),
         alt.Y('sum(win):Q', axis=alt.Axis(title='Number of Wins', tickMinStep=1)),
         color=alt.Color('stack:N', legend=None)
@@ -68,7 +219,9 @@ def plot_first_experiment_bars(data, n_card_pairs):
         grid=False
     ).configure_view(
         strokeWidth=0
-    )#.display(renderer='svg')
+    )
+    # only the first experiment is shown
+    return precompute_transforms(chart)#.display(renderer='svg')
     
 def plot_first_experiment_lines(data):
     """Plot course of first experiment as line chart"""
@@ -111,11 +264,16 @@ def plot_first_experiment_lines(data):
         height = 265
     )
 
-    # combine & show plots
-    alt.vconcat(ticks, lines).display(renderer='svg')
+    # combine & show plots, only the first experiment is sent to the browser
+    precompute_transforms(alt.vconcat(ticks, lines)).display(renderer='svg')
     
 
-def plot_repeated_experiments(data, n_card_pairs, show='Experiments, Histogram, Std', plot_height=225):
+def plot_repeated_experiments(
+        data, n_card_pairs, show='Experiments, Histogram, Std', plot_height=225, aggregated=False
+    ):
+    """Plot the results of all experiments after drawing a selectable number of card pairs.
+    Pass aggregated=True if data comes from cumulative_wins_df.
+    """
 
     plots = []
 
@@ -135,12 +293,19 @@ def plot_repeated_experiments(data, n_card_pairs, show='Experiments, Histogram,
     # filter data
     base = alt.Chart(data).add_selection(
         selection
-    ).transform_filter(
-        alt.datum.card_pair <= alt.expr.toNumber(selection.card_pair)
-    ).transform_aggregate(
-        p_win='mean(win):Q',
-        groupby=["stack","experiment"]
     )
+    if aggregated:
+        # the winning probabilities are precomputed for each number of card pairs
+        base = base.transform_filter(
+            alt.expr.toNumber(alt.datum.card_pair) == alt.expr.toNumber(selection.card_pair)
+        )
+    else:
+        base = base.transform_filter(
+            alt.datum.card_pair <= alt.expr.toNumber(selection.card_pair)
+        ).transform_aggregate(
+            p_win='mean(win):Q',
+            groupby=["stack","experiment"]
+        )
     scale = alt.Scale(domain=[-.1,1.1])
 
 
@@ -238,7 +403,12 @@ def plot_repeated_experiments(data, n_card_pairs, show='Experiments, Histogram,
     ).display(renderer='svg')
     
 
-def plot_experiment_bars_with_errors(data, n_card_pairs, n_card_pairs_init, n_repeats):
+def plot_experiment_bars_with_errors(
+        data, n_card_pairs, n_card_pairs_init, n_repeats, aggregated=False
+    ):
+    """Plot the winning probabilities of one selectable experiment with 95% confidence intervals.
+    Pass aggregated=True if data comes from cumulative_wins_df.
+    """
 
     # define input selection
     input_n_cards = alt.binding(
@@ -265,29 +435,54 @@ def plot_experiment_bars_with_errors(data, n_card_pairs, n_card_pairs_init, n_re
     )
     
     # filter data
+    # there are sometimes problems with automatic types in comparisons, 
+    # when comparing datum with a selection.
+    # hence we just put the explicit types everywhere
+    if aggregated:
+        # keep only the precomputed row for the selected number of card pairs
+        card_pair_filter = (
+            alt.expr.toNumber(alt.datum.card_pair) == alt.expr.toNumber(selection_n_cards.card_pair)
+        )
+    else:
+        card_pair_filter = (
+            alt.expr.toNumber(alt.datum.card_pair) <= alt.expr.toNumber(selection_n_cards.card_pair)
+        )
     base = alt.Chart(data).add_selection(
         selection_n_cards, selection_experiment
     ).transform_filter(
-        # there are sometimes problems with automatic types in comparisons, 
-        # when comparing datum with a selection.
-        # hence we just put the explicit types everywhere
-          (alt.expr.toNumber(alt.datum.card_pair)  <= alt.expr.toNumber(selection_n_cards.card_pair))
+          card_pair_filter
         & (alt.expr.toNumber(alt.datum.experiment) == alt.expr.toNumber(selection_experiment.experiment))
-    
     )
 
-    # plot bar chart
-    bars = base.mark_bar().encode(
-        x='stack:N',
-        y='mean(win):Q',
-        color=alt.Color('stack:N', legend=None)
-    )
+    if aggregated:
+        # use the normal approximation with the precomputed standard error
+        base = base.transform_calculate(
+            p_win_min='datum.p_win - 1.96 * datum.p_win_se',
+            p_win_max='datum.p_win + 1.96 * datum.p_win_se',
+        )
+        bars = base.mark_bar().encode(
+            x='stack:N',
+            y='p_win:Q',
+            color=alt.Color('stack:N', legend=None)
+        )
+        errors = base.mark_errorbar(rule=alt.MarkConfig(size=2)).encode(
+            alt.Y('p_win_min:Q', title='Winning probability'),
+            alt.Y2('p_win_max:Q'),
+            x=alt.X('stack:N', title='Card Stack')
+        )
+    else:
+        # plot bar chart
+        bars = base.mark_bar().encode(
+            x='stack:N',
+            y='mean(win):Q',
+            color=alt.Color('stack:N', legend=None)
+        )
 
-    # plot errorbars
-    errors=base.mark_errorbar(extent='ci', rule=alt.MarkConfig(size=2)).encode(
-        alt.Y('win:Q', title='Winning probability'),
-        x=alt.X('stack:N', title='Card Stack')
-    )
+        # plot errorbars
+        errors=base.mark_errorbar(extent='ci', rule=alt.MarkConfig(size=2)).encode(
+            alt.Y('win:Q', title='Winning probability'),
+            x=alt.X('stack:N', title='Card Stack')
+        )
 
     # combine plot
     alt.layer(bars, errors).properties(
@@ -297,4 +492,81 @@ def plot_experiment_bars_with_errors(data, n_card_pairs, n_card_pairs_init, n_re
         grid=False
     ).configure_view(
         strokeWidth=0
-    ).display(renderer='svg')
\ No newline at end of file
+    ).display(renderer='svg')
+    
+
+def plot_experiment_summary(summary, histogram, n_card_pairs, plot_height=225):
+    """Plot the distribution of the winning probabilities of all experiments after drawing 
+    a selectable number of card pairs, from the summaries returned by summarize_experiments.
+    Like plot_repeated_experiments, without the individual experiments.
+    """
+    input_n_cards = alt.binding(
+        input='range',
+        min=1,
+        max=n_card_pairs, 
+        step=1, 
+        name='Card pairs per Experiment: '
+    )
+    selection = alt.selection_single(
+        bind=input_n_cards,
+        init={'card_pair': min(25, n_card_pairs)}
+    )
+    card_pair_filter = (
+        alt.expr.toNumber(alt.datum.card_pair) == alt.expr.toNumber(selection.card_pair)
+    )
+    scale = alt.Scale(domain=[-.1,1.1])
+
+    # histogram over experiment results
+    hist = alt.Chart(
+        df_to_datasource(histogram, embed_in_notebook=True)
+    ).mark_bar(
+        fillOpacity=.33,
+        strokeOpacity=.66,
+        strokeWidth=2,
+        cornerRadius=2,
+    ).encode(
+        y=alt.Y(
+            'bin_start:Q', 
+            scale=scale, 
+            axis=alt.Axis(values=np.arange(0,1.1,.2), title='Winning probability', grid=True), 
+        ),
+        y2='bin_end:Q',
+        x=alt.X('experiments:Q', stack=None, title='Number of experiments'),
+        x2='zero:Q',
+        color=alt.Color('stack:N', legend=alt.Legend(title='Stack')),
+        stroke=alt.Color('stack:N', legend=None),
+        order='stack:Q',
+    ).add_selection(
+        selection
+    ).transform_filter(
+        card_pair_filter
+    ).transform_calculate(
+        zero='0'
+    ).properties(
+        width=150,
+        height=plot_height
+    )
+
+    # mean ± standard deviation
+    errorbars = alt.Chart(
+        df_to_datasource(summary, embed_in_notebook=True)
+    ).mark_errorbar(rule=alt.MarkConfig(size=2)).encode(
+        y=alt.Y('p_win_min:Q', axis=None, scale=scale),
+        y2='p_win_max:Q',
+        x=alt.X('stack:Q', axis=None, scale=alt.Scale(domain=[0,3])),
+        color='stack:N',
+    ).transform_filter(
+        card_pair_filter
+    ).transform_calculate(
+        p_win_min='datum.p_win_mean - datum.p_win_std',
+        p_win_max='datum.p_win_mean + datum.p_win_std',
+    ).properties(
+        width=25,
+        height=plot_height
+    )
+
+    alt.concat(hist, errorbars).configure_axis(
+        grid=False
+    ).configure_view(
+        strokeWidth=0
+    ).display(renderer='svg')
@@ -1,9 +1,11 @@
-import altair as alt
-import pandas as pd
 import numpy as np
-import itertools
 
-from .plotting import parameter_selection
+from . import lazy_import
+from .plotting import parameter_selection, df_to_datasource
+from .memoize import memoize
+
+alt = lazy_import('altair')
+pd  = lazy_import('pandas')
 
 def plot_uniform_probability_mass_function(maximum_outcome=20):
     max_outcome = parameter_selection(
@@ -134,32 +136,68 @@ def plot_normal_distribution(xmin = -5, xmax = 5, stdmin=.5, stdmax=5, step=.1,)
             width=500
     )
     
-def plot_sum_of_n_dice(n_max=7):
-   
-    # a naive brute-force calculation of the probability mass function for the sum of n dice
-    # ======================================================================================
 
-    res = pd.DataFrame(index=pd.Index(range(1,6*n_max+1), name='Sum of Points'))
-    # for n = 1 ... n_max dice
-    for n in range(1, n_max+1):
-        # calculate number of possibilities to get each possible outcome value
-        outcome, possibilities = np.unique(
-            # sum of points for each outcome
-            np.array(
-                # create list of all possible outcomes
-                # each outcome is a list of the number of points for each die
-                list(itertools.product(*[list(range(1,7))]*n))
-            ).sum(1), 
-            return_counts=True
-        )
-        res.loc[outcome, n] = possibilities
+def die_probability_mass_function(die=6):
+    """Return points & probabilities for a single die.
     
-    # normalise counts to probabilities
-    res /= res.sum()
+    die can be
+    - the number of faces, e.g. 6 or 20, numbered 1, 2, ...
+    - a sequence of (integer) points on the faces, e.g. [1, 1, 2, 3], each face equally likely
+    - a dict mapping points to probabilities, e.g. {1: .5, 6: .5}
+    """
+    if isinstance(die, dict):
+        points, probabilities = zip(*die.items())
+    elif np.ndim(die) == 0:
+        points = np.arange(1, die+1)
+        probabilities = np.ones(die)
+    else:
+        points = die
+        probabilities = np.ones(len(die))
+    points = np.asarray(points)
+    if not np.issubdtype(points.dtype, np.integer):
+        raise ValueError("Points on a die must be integers.")
+        
+    # dense pmf for all points between the smallest and the largest one
+    min_points = points.min()
+    pmf = np.zeros(points.max() - min_points + 1)
+    np.add.at(pmf, points - min_points, probabilities)
+    return np.arange(min_points, points.max()+1), pmf / pmf.sum()
+
 
-    # add mean points per die
-    dice_sum_df = pd.melt(res.reset_index(), id_vars=['Sum of Points'], var_name='Dice', value_name='Probability')
+@memoize
+def sum_of_n_dice_df(n_max=7, die=6, min_probability=0):
+    """Return probabilities for the sum of points for 1 ... n_max dice in long format.
+    
+    Columns: Sum of Points, Dice, Probability, Points per Die.
+    Sums with a probability of at most min_probability (by default the impossible ones) 
+    are left out.
+    See die_probability_mass_function for possible values of die.
+    """
+    points, pmf = die_probability_mass_function(die)
+    res = []
+    # the pmf of n dice is the pmf of n-1 dice convolved with the pmf of one die
+    sum_pmf = np.ones(1)
+    for n in range(1, n_max+1):
+        sum_pmf = np.convolve(sum_pmf, pmf)
+        sum_points = np.arange(n * points[0], n * points[0] + len(sum_pmf))
+        keep = sum_pmf > min_probability
+        res.append(pd.DataFrame({
+            'Sum of Points': sum_points[keep],
+            'Dice':          n,
+            'Probability':   sum_pmf[keep],
+        }))
+    dice_sum_df = pd.concat(res, ignore_index=True)
     dice_sum_df['Points per Die'] = dice_sum_df['Sum of Points'] / dice_sum_df['Dice']
+    return dice_sum_df
+
+    
+def plot_sum_of_n_dice(n_max=7, die=6, min_probability=1e-6):
+    """Plot the probability mass function for the sum of n dice, n selectable from 1 to n_max.
+    
+    Sums with probabilities below min_probability wouldn't be visible and are left out.
+    See die_probability_mass_function for possible values of die.
+    """
+    dice_sum_df = sum_of_n_dice_df(n_max, die, min_probability)
     
     # plot
     # ====
@@ -181,15 +219,17 @@ def plot_sum_of_n_dice(n_max=7):
     )
     
     # chart base
+    # many dice give more than the 5000 rows altair allows by default,
+    # so they are embedded in the notebook, but only into the slides if the data is small
     chart = alt.Chart(
-        dice_sum_df
+        df_to_datasource(dice_sum_df, embed_in_notebook=True)
     ).mark_bar().encode(
         x=alt.X('Value:Q', title='Points'),
         y='Probability:Q'
     )
     
     # add parameters & filters
-    return chart.transform_filter(
+    chart = chart.transform_filter(
         +alt.datum.Dice == +n_dice.value,
     ).transform_fold(
         # transform the two measure columns to long format
@@ -202,4 +242,5 @@ def plot_sum_of_n_dice(n_max=7):
         selection
     ).properties(
         width=250
-    ).display(renderer='svg')
\ No newline at end of file
+    )
+    return chart.display(renderer='svg')
\ No newline at end of file
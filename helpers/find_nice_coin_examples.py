@@ -3,13 +3,28 @@
 Basic shell usage:
     python3 find_nice_coin_examples.py
     
+More options, e.g. to use several processes:
+    python3 find_nice_coin_examples.py --help
+    
 Alternatively, import and use find_coins
 """
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, combinations_with_replacement
+from math import comb
+from time import monotonic
+import argparse
 import numpy as np
+try:
+    from .memoize import memoize
+except ImportError:
+    # executed as a script
+    from memoize import memoize
 
 coin_types_default = np.array([1,2,5,10,20,50])
 min_coins_default  = 5
 max_coins_default  = 9
+batch_size_default = 100000
+progress_interval  = 0.25 # min. seconds between progress updates
 
 def int_to_base(number:int,base:int):
     digits = []
@@ -18,13 +33,163 @@ def int_to_base(number:int,base:int):
         number //= base
     return digits[::-1]
 
+def n_combinations(n_coins:int, n_coin_types:int):
+    """Number of combinations of n_coins out of n_coin_types, ignoring the order of the coins."""
+    return comb(n_coin_types + n_coins - 1, n_coins)
+
+
+def coin_combinations(n_coins:int, coin_types, prefix:tuple=()):
+    """Return array with one combination of n_coins per row, ignoring the order of the coins.
+    
+    Only combinations starting with the coins at the (sorted) indices in prefix are returned. 
+    Rows are sorted if coin_types is.
+    """
+    first  = prefix[-1] if prefix else 0
+    n_rest = n_coins - len(prefix)
+    rest = np.fromiter(
+        chain.from_iterable(combinations_with_replacement(range(first, len(coin_types)), n_rest)),
+        dtype=int
+    ).reshape(n_combinations(n_rest, len(coin_types) - first), n_rest)
+    coin_indices = np.hstack([np.broadcast_to(prefix, (len(rest), len(prefix))), rest])
+    return np.asarray(coin_types)[coin_indices.astype(int)]
+
+
+def split_combinations(n_coins:int, n_coin_types:int, max_combinations:int, prefix:tuple=()):
+    """Yield prefixes for coin_combinations which split all combinations into consecutive 
+    chunks of at most max_combinations (or a single combination).
+    """
+    first  = prefix[-1] if prefix else 0
+    n_rest = n_coins - len(prefix)
+    if n_rest == 0 or n_combinations(n_rest, n_coin_types - first) <= max_combinations:
+        yield prefix
+    else:
+        for i in range(first, n_coin_types):
+            yield from split_combinations(n_coins, n_coin_types, max_combinations, prefix + (i,))
+
+
+def nice_coins(coins_in_pocket):
+    """Return boolean mask for rows of sorted coins with more than two different values, 
+    an integer standard deviation, and a mean that differs from the median.
+    """
+    n_unique_coins = 1 + (np.diff(coins_in_pocket, axis=1) != 0).sum(axis=1)
+    nice = n_unique_coins > 2
+    # only calculate statistics where necessary
+    candidates  = coins_in_pocket[nice]
+    coin_median = np.median(candidates, axis=1)
+    coin_mean   = np.mean(candidates, axis=1)
+    coin_std    = np.std(candidates, axis=1)
+    nice[nice]  = (coin_std == np.trunc(coin_std)) & (coin_mean != coin_median)
+    return nice
+
+
+def find_nice_coins_in_chunk(n_coins:int, coin_types, prefix:tuple):
+    """Test one chunk of combinations, see coin_combinations.
+    Returns n_coins, number of tested combinations, list of nice combinations.
+    """
+    coins_in_pocket = coin_combinations(n_coins, coin_types, prefix)
+    solutions = [tuple(coins.tolist()) for coins in coins_in_pocket[nice_coins(coins_in_pocket)]]
+    return n_coins, len(coins_in_pocket), solutions
+
+
+@memoize(ignore=('batch_size', 'workers', 'verbose'))
+def search_coins(
+        min_coins:int=min_coins_default, 
+        max_coins:int=max_coins_default,
+        coin_types:list=coin_types_default,
+        batch_size:int=batch_size_default,
+        workers:int=1,
+        verbose:bool=True
+    ):
+    """Search for combinations of min_coins to max_coins drawn out of coin_types.
+    
+    Only combinations that differ by more than the order of the coins are tested, 
+    in chunks of up to batch_size. With workers > 1, the chunks are distributed over
+    as many processes. The results are the same for any number of workers.
+    Only the progress is printed (if verbose), so cached results don't lose any output.
+    Returns list of (n_coins, nice_combination) in the order they were found.
+    """
+    coin_types = np.sort(coin_types)
+    n_coin_types = len(coin_types)
+    coin_counts = range(min_coins, max_coins+1)
+    found = []
+    
+    chunks = [
+        (n_coins, coin_types, prefix) 
+        for n_coins in coin_counts
+        for prefix in split_combinations(n_coins, n_coin_types, batch_size)
+    ]
+    n_total = sum(n_combinations(n_coins, n_coin_types) for n_coins in coin_counts)
+    
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # chunks are returned in order, so the output is deterministic
+        chunk_results = executor.map(find_nice_coins_in_chunk, *zip(*chunks))
+    else:
+        executor = None
+        chunk_results = (find_nice_coins_in_chunk(*chunk) for chunk in chunks)
+    
+    n_tested = 0
+    start_time = last_progress_time = monotonic()
+    try:
+        for n_coins, n_tested_in_chunk, solutions in chunk_results:
+            n_tested += n_tested_in_chunk
+            found.extend((n_coins, coins) for coins in solutions)
+            
+            now = monotonic()
+            if verbose and now - last_progress_time > progress_interval:
+                print(
+                    f"\r {int(100*n_tested/n_total)}% "
+                    f"({n_tested / (now - start_time):.0f} combinations/s)", 
+                    end=""
+                )
+                last_progress_time = now
+    finally:
+        if executor is not None:
+            executor.shutdown()
+            
+    if verbose:
+        print("\r    ", end="\r")
+    return found
+
+
 def find_coins(
+        min_coins:int=min_coins_default, 
+        max_coins:int=max_coins_default,
+        coin_types:list=coin_types_default,
+        batch_size:int=batch_size_default,
+        workers:int=1,
+        verbose:bool=True
+    ):
+    """Search for combinations of min_coins to max_coins drawn out of coin_types (see search_coins),
+    and print them if verbose, also when the search result is cached.
+    Returns dict with n_coins: set_of_nice_results
+    """
+    n_coin_types = len(coin_types)
+    coin_counts = range(min_coins, max_coins+1)
+    results = {n_coins: set() for n_coins in coin_counts}
+    if verbose:
+        for n_coins in coin_counts:
+            print(f"{n_coins} coins ({n_combinations(n_coins, n_coin_types)} combinations)")
+    
+    for n_coins, coins in search_coins(min_coins, max_coins, coin_types, batch_size, workers, verbose):
+        if verbose:
+            print(
+                f"{n_coins} coins {list(coins)}: median = {np.median(coins)}, "
+                f"mean = {np.mean(coins)}, std = {np.std(coins)}"
+            )
+        results[n_coins].add(coins)
+    return results
+
+
+def find_coins_brute_force(
         min_coins:int=min_coins_default, 
         max_coins:int=max_coins_default ,
         coin_types:list=coin_types_default
     ):
-    """Brute-force search for combinations of min_coins to max_coins drawn out of coin_types.
+    """Brute-force search over all ordered combinations of min_coins to max_coins drawn out of coin_types.
     Returns dict with n_coins: set_of_nice_results
+    
+    Much slower than find_coins, kept for reference.
     """
     n_coin_types = len(coin_types)
     results = dict()
@@ -61,4 +226,44 @@ def find_coins(
     return results
 
 if __name__ == "__main__":
-    find_coins()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Find useful combinations of coins for mental calculations')
+    parser.add_argument(
+        '--min-coins', 
+        default=min_coins_default,
+        type=int,
+        help=f'Smallest number of coins in a combination (default: {min_coins_default})'
+    )
+    parser.add_argument(
+        '--max-coins', 
+        default=max_coins_default,
+        type=int,
+        help=f'Largest number of coins in a combination (default: {max_coins_default})'
+    )
+    parser.add_argument(
+        '--coins', 
+        default=coin_types_default,
+        type=int,
+        nargs='+',
+        help=f'Values of the available coin types (default: {" ".join(map(str, coin_types_default))})'
+    )
+    parser.add_argument(
+        '--workers', 
+        default=1,
+        type=int,
+        help='Number of processes to search in parallel (default: 1)'
+    )
+    parser.add_argument(
+        '--batch-size', 
+        default=batch_size_default,
+        type=int,
+        help=f'Max. number of combinations tested at once (default: {batch_size_default})'
+    )
+    args = parser.parse_args()
+    
+    find_coins(
+        min_coins=args.min_coins,
+        max_coins=args.max_coins,
+        coin_types=np.array(args.coins),
+        batch_size=args.batch_size,
+        workers=args.workers
+    )
@@ -0,0 +1,155 @@
+"""Cache results of slow data generators on disk, shared by notebook kernels & slide builds.
+
+Results are stored in CACHE_DIR, named by the function, a hash of the source of its module
+and a hash of the arguments. DataFrames are stored as Parquet (if pyarrow is installed),
+arrays as NPZ and anything else pickled. The least recently used results are removed
+when the cache grows beyond CACHE_MAX_BYTES.
+Set the environment variable HELPERS_CACHE=FALSE to always call the functions.
+"""
+import os
+import sys
+import pickle
+import hashlib
+import inspect
+import functools
+import importlib.util
+import numpy as np
+
+CACHE_DIR       = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.helpers_cache')
+CACHE_MAX_BYTES = 500 * 10**6
+KEY_LENGTH      = 16 # hex digits
+EXTENSIONS      = ('parquet', 'npz', 'pickle')
+
+
+def cache_dir():
+    return os.environ.get('HELPERS_CACHE_DIR', CACHE_DIR)
+
+
+def cache_enabled():
+    return os.environ.get('HELPERS_CACHE', 'TRUE') == 'TRUE'
+
+
+def source_hash(func):
+    "Hash of the source of the module defining func, so changes to anything it calls there invalidate results"
+    module = sys.modules[func.__module__]
+    try:
+        source = inspect.getsource(module)
+    except (OSError, TypeError):
+        source = inspect.getsource(func)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def argument_repr(value):
+    "repr of an argument, arrays by their contents"
+    if isinstance(value, np.ndarray):
+        return f"ndarray({value.dtype}, {value.shape}, {hashlib.sha256(value.tobytes()).hexdigest()})"
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}({', '.join(argument_repr(v) for v in value)})"
+    if isinstance(value, dict):
+        return f"dict({', '.join(f'{k!r}: {argument_repr(v)}' for k, v in sorted(value.items()))})"
+    return repr(value)
+
+
+def write_result(result, path_without_extension):
+    "Write result in the format matching its type, return the path"
+    # pandas & pyarrow are only imported when needed, find_coins doesn't use them
+    is_data_frame = type(result).__name__ == 'DataFrame' and type(result).__module__.startswith('pandas')
+    if is_data_frame and importlib.util.find_spec('pyarrow') is not None:
+        extension = 'parquet'
+    elif isinstance(result, np.ndarray):
+        extension = 'npz'
+    else:
+        extension = 'pickle'
+    path = f"{path_without_extension}.{extension}"
+    # write to a temporary file first, other processes may read the cache at the same time
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if extension == 'parquet':
+        result.to_parquet(tmp_path)
+    elif extension == 'npz':
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, result=result)
+    else:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_result(path):
+    if path.endswith('.parquet'):
+        import pandas as pd
+        return pd.read_parquet(path)
+    elif path.endswith('.npz'):
+        with np.load(path) as npz:
+            return npz['result']
+    else:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def evict(directory, max_bytes=CACHE_MAX_BYTES):
+    "Remove the least recently used results until the cache is smaller than max_bytes"
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith(EXTENSIONS):
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in files)
+    for _, size, name in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def memoize(func=None, ignore=()):
+    """Decorator caching the results of func on disk (see module docstring).
+    Arguments in ignore don't change the result (e.g. verbose) and are left out of the key.
+    The uncached function is available as func.__wrapped__.
+    """
+    if func is None:
+        return functools.partial(memoize, ignore=ignore)
+    signature = inspect.signature(func)
+    name = f"{func.__module__}.{func.__qualname__}"
+    # hashed once, like the code that runs
+    func_hash = source_hash(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not cache_enabled():
+            return func(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = ', '.join(
+            f"{k}={argument_repr(v)}" for k, v in bound.arguments.items() if k not in ignore
+        )
+        key = hashlib.sha256(f"{func_hash}({arguments})".encode()).hexdigest()[:KEY_LENGTH]
+        directory = cache_dir()
+        path_without_extension = os.path.join(directory, f"{name}-{key}")
+        for extension in EXTENSIONS:
+            path = f"{path_without_extension}.{extension}"
+            try:
+                result = read_result(path)
+            except FileNotFoundError:
+                continue
+            except Exception:
+                # e.g. written by incompatible library versions, compute again
+                break
+            # the modification time marks the last use
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            return result
+        result = func(*args, **kwargs)
+        os.makedirs(directory, exist_ok=True)
+        write_result(result, path_without_extension)
+        evict(directory)
+        return result
+    return wrapper
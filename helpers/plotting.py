@@ -1,11 +1,27 @@
 """Helpers to style altair plots and to improve working with datasets.
 """
 
-import altair as alt
 import numpy as np
-import pandas as pd
 import os
-from IPython.core.display import HTML
+import re
+import json
+import uuid
+import hashlib
+
+from . import lazy_import
+
+alt = lazy_import('altair')
+pd  = lazy_import('pandas')
+
+# exported datasets are named by a hash of their content, so unchanged data isn't rewritten
+# and can be cached by browsers forever (make_slides removes data that isn't used anymore)
+DATA_DIR          = 'data' # in export_dir
+DATA_HASH_LENGTH  = 16     # hex digits
+# by default, datasets are only embedded into the slides if they are smaller than this
+EMBED_MAX_BYTES   = 50000
+EMBED_SAMPLE_ROWS = 100 # embedded_size extrapolates from this many rows
+# DataFrames behind exported urls, so that charts using them can be precomputed
+exported_data = {}
 
 def slide_theme():
     """Set a theme with a bigger font size for better readability during presenstations.
@@ -55,10 +71,27 @@ def slide_theme():
         }
     }
 
+def slide_renderer(spec, embed_options=None, **kwargs):
+    """Altair renderer for the slides: instead of embedding each chart when the deck is loaded,
+    the spec is stored as json and the slide template embeds the chart when its slide is shown.
+    """
+    chart_id = f"altair-viz-{uuid.uuid4().hex}"
+    chart = {'spec': spec, 'embedOptions': {'mode': 'vega-lite', **(embed_options or {})}}
+    # "</" would end the script
+    chart_json = json.dumps(chart).replace('</', '<\\/')
+    return {'text/html': (
+        f'<div class="vega-chart" id="{chart_id}"></div>\n'
+        f'<script class="vega-chart-spec" type="application/json">{chart_json}</script>'
+    )}
+
+
 def enable_slide_theme():
     # activate theme
     alt.themes.register("statistics_slide_theme", slide_theme)
     alt.themes.enable("statistics_slide_theme");
+    if os.environ.get('CONVERT') == 'TRUE':
+        alt.renderers.register('slides', slide_renderer)
+        alt.renderers.enable('slides')
     # the three dots menu is useful but a bit distracting in slides
     alt.renderers.set_embed_options(actions=False);
     
@@ -67,23 +100,80 @@ def import_slide_theme_font_in_notebook():
     """Have the font used by the slide theme, available in notebook.
     Returns a hidden HTML element.
     """
+    from IPython.core.display import HTML
     return HTML(
         '<link rel="stylesheet" type="text/css" '
         'href="./reveal.js/dist/theme/fonts/source-sans-pro/source-sans-pro.css">'
     )
 
 
+def vega_parse_types(df):
+    """Return vega's format.parse for the columns of df, 
+    so that vega doesn't have to guess the types of columns loaded from a csv.
+    """
+    parse = {}
+    for column, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            parse[column] = 'boolean'
+        elif pd.api.types.is_numeric_dtype(dtype):
+            parse[column] = 'number'
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            parse[column] = 'date'
+    return parse
+
+
+def export_data(content, export_dir='slides', extension='csv'):
+    """Write content (str or bytes) to export_dir/data/<hash>.<extension>, 
+    unless a file with the same content exists already. 
+    Return the url relative to export_dir.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    url = '{}/{}.{}'.format(
+        DATA_DIR, hashlib.sha256(content).hexdigest()[:DATA_HASH_LENGTH], extension
+    )
+    path = os.path.join(export_dir, url)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, parallel conversions might export the same data
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return url
+
+
+def embedded_size(df, sample_rows=EMBED_SAMPLE_ROWS):
+    """Approximate number of bytes df adds to a chart when it is embedded,
+    extrapolated from the first sample_rows rows, so big frames are not serialized.
+    """
+    if len(df) <= sample_rows:
+        return len(df.to_json(orient='records'))
+    return len(df.head(sample_rows).to_json(orient='records')) * len(df) // sample_rows
+
+
 def df_to_datasource(
         df,
         embed_in_notebook = False,
-        embed_in_slides   = False,
-        export_dir  = 'slides',
-        export_file = '1_cards_data.csv'
+        embed_in_slides   = 'auto',
+        export_dir  = None,
+        export_file = None,
+        dtypes      = None,
+        parse_types = True
     ):
     """Transparently replace datasource depending on notebook use or export. 
     
     - Embedding will lead to big files. 
     - Altair will complain when embeding more than 5000 rows, so we disable that warning when embedding.
+    - With embed_in_slides='auto', data is embedded into the slides if embedded_size(df) <= EMBED_MAX_BYTES.
+      Bigger data is exported and loaded from a url. make_slides reports the bytes embedded & linked per deck.
+    - dtypes is passed to df.astype before exporting, e.g. dtypes={'win': bool}. 
+      Booleans are exported as 0 / 1.
+    - export_dir defaults to $EXPORT_DIR (set by make_slides) or slides.
+    - Exported data is stored in export_dir/data/ named by its content (see export_data). 
+      Pass an export_file to use a fixed file name instead.
+    - With parse_types=True, the types of the exported columns are passed to vega (see vega_parse_types).
+      That saves type inference in the browser and avoids comparing strings with numbers.
     
     Some explanations:
     A better alternative to embedding is to load data from a url. The only issue is, that then you have
@@ -103,17 +193,32 @@ def df_to_datasource(
     If you really want to mail the file to someone or view them offline, you have to embed and live with the
     bigger file.
     """
+    if embed_in_slides == 'auto' and os.environ.get('CONVERT') == 'TRUE':
+        embed_in_slides = embedded_size(df) <= EMBED_MAX_BYTES
     if not embed_in_slides and os.environ.get('CONVERT') == 'TRUE':
         # the exported slide should be hosted such that
         # the data is hosted on the same server
-        df.to_csv(
-            os.path.join(export_dir, export_file), 
-            index=False
-        )
+        if export_dir is None:
+            export_dir = os.environ.get('EXPORT_DIR', 'slides')
+        if dtypes is not None:
+            df = df.astype(dtypes)
+        # vega parses 0 / 1 as booleans, but not pandas' True / False
+        csv = df.astype({
+            column: int for column, dtype in df.dtypes.items() if pd.api.types.is_bool_dtype(dtype)
+        }).to_csv(index=False)
+        if export_file is None:
+            export_file = export_data(csv, export_dir)
+        else:
+            with open(os.path.join(export_dir, export_file), 'w') as f:
+                f.write(csv)
+        data_format = dict(type='csv')
+        if parse_types:
+            data_format['parse'] = vega_parse_types(df)
         data = alt.Data(
             url=export_file, 
-            format=dict(type='csv')
+            format=data_format
         )
+        exported_data[export_file] = df
     elif not embed_in_notebook and not os.environ.get('CONVERT') == 'TRUE':
         # use data transformer
         # json creates bigger files but is more reliable (see manual parsing note above)
@@ -129,9 +234,188 @@ def df_to_datasource(
     return data
 
 
+# precompute transforms
+# ====================
+# vega expressions in static filters, e.g. "(datum.experiment == 1) & (datum.win > 0)"
+EXPRESSION_TOKEN_RE = re.compile(r"""\s*(?:
+    datum\.(?P<field>[A-Za-z_]\w*) | datum\[(?P<quote>['"])(?P<quoted_field>.*?)(?P=quote)\] |
+    (?P<number>\d+\.?\d*(?:[eE][+-]?\d+)?) | (?P<string>'[^']*'|"[^"]*") | (?P<literal>true|false) |
+    (?P<operator>===|!==|==|!=|<=|>=|<|>|&&|\|\||&|\||!|\(|\)|\+|-|\*|/|%)
+)""", re.VERBOSE)
+EXPRESSION_OPERATORS = {
+    '===': '==', '!==': '!=', '&&': ' and ', '&': ' and ', '||': ' or ', '|': ' or ', '!': ' not '
+}
+AGGREGATE_OPS = {
+    'sum': 'sum', 'mean': 'mean', 'average': 'mean', 'median': 'median', 'min': 'min', 'max': 'max',
+    'count': 'size', 'valid': 'count', 'distinct': 'nunique', 'variance': 'var', 'stdev': 'std',
+}
+
+
+def expression_to_pandas(expression):
+    """Translate a vega expression that only uses fields of datum to pandas.eval syntax.
+    Return None if the expression uses anything else, e.g. a selection or a function.
+    """
+    translated = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = EXPRESSION_TOKEN_RE.match(expression, position)
+        if match is None:
+            return None
+        position = match.end()
+        field = match.group('field') or match.group('quoted_field')
+        if field is not None:
+            translated.append('`{}`'.format(field))
+        elif match.group('literal') is not None:
+            translated.append(match.group('literal').capitalize())
+        elif match.group('operator') is not None:
+            translated.append(EXPRESSION_OPERATORS.get(match.group('operator'), match.group('operator')))
+        else:
+            translated.append(match.group('number') or match.group('string'))
+    return ''.join(translated)
+
+
+def apply_filter(df, predicate):
+    "Return filtered df or None if the predicate can't be evaluated in pandas"
+    if isinstance(predicate, str):
+        expression = expression_to_pandas(predicate)
+        if expression is None:
+            return None
+        return df[df.eval(expression, engine='python').astype(bool)]
+    if isinstance(predicate, dict) and 'field' in predicate and predicate.get('timeUnit') is None:
+        values = df[predicate['field']]
+        if 'equal' in predicate:
+            return df[values == predicate['equal']]
+        if 'oneOf' in predicate:
+            return df[values.isin(predicate['oneOf'])]
+        for key, compare in (('lt', 'lt'), ('lte', 'le'), ('gt', 'gt'), ('gte', 'ge')):
+            if key in predicate:
+                return df[getattr(values, compare)(predicate[key])]
+    return None
+
+
+def apply_aggregate(df, transform):
+    "Return aggregated df or None if the aggregation can't be done in pandas"
+    groupby = transform.get('groupby', [])
+    aggregations = {}
+    for aggregate in transform['aggregate']:
+        if aggregate.get('op') not in AGGREGATE_OPS or 'as' not in aggregate:
+            return None
+        aggregations[aggregate['as']] = (
+            aggregate.get('field', df.columns[0]), AGGREGATE_OPS[aggregate['op']]
+        )
+    if groupby:
+        return df.groupby(groupby, sort=False).agg(**aggregations).reset_index()
+    return df.groupby(np.zeros(len(df), dtype=int)).agg(**aggregations).reset_index(drop=True)
+
+
+def apply_window(df, transform):
+    """Return df with cumulative window fields or None if the window isn't cumulative.
+    Only windows without sort (i.e. in data order) are supported, vega handles ties differently.
+    """
+    if transform.get('frame', [None, 0]) != [None, 0] or 'sort' in transform:
+        return None
+    groupby = transform.get('groupby', [])
+    grouped = df.groupby(groupby, sort=False) if groupby else df.groupby(np.zeros(len(df), dtype=int))
+    df = df.copy()
+    for window in transform['window']:
+        op, field, name = window.get('op'), window.get('field'), window.get('as')
+        if name is None:
+            return None
+        if op in ('count', 'row_number'):
+            df[name] = grouped.cumcount() + 1
+        elif op == 'sum':
+            df[name] = grouped[field].cumsum()
+        elif op == 'mean':
+            df[name] = grouped[field].cumsum() / (grouped.cumcount() + 1)
+        elif op in ('min', 'max'):
+            df[name] = getattr(grouped[field], 'cum' + op)()
+        else:
+            return None
+    return df
+
+
+def apply_fold(df, transform):
+    "Return df in long format"
+    key, value = transform.get('as', ['key', 'value'])
+    return df.melt(
+        id_vars=[c for c in df.columns if c not in transform['fold']],
+        value_vars=transform['fold'],
+        var_name=key,
+        value_name=value,
+    )
+
+
+def apply_transform(df, transform):
+    "Return transformed df or None if the transform has to be done by vega-lite"
+    if 'filter' in transform:
+        return apply_filter(df, transform['filter'])
+    if 'aggregate' in transform:
+        return apply_aggregate(df, transform)
+    if 'window' in transform:
+        return apply_window(df, transform)
+    if 'fold' in transform:
+        return apply_fold(df, transform)
+    return None
+
+
+def precompute_transforms(chart, **datasource_kwargs):
+    """Apply the leading transforms of chart that don't depend on selections in pandas, 
+    so that only the reduced data and the remaining transforms end up in the chart.
+    
+    The data of the chart must be a DataFrame or exported by df_to_datasource. 
+    Reduced DataFrames stay DataFrames, so they are embedded like the input. Reduced exported data 
+    (or any data if datasource_kwargs are given) is passed through df_to_datasource with datasource_kwargs,
+    small data is embedded by default. Compound charts are precomputed per subchart.
+    """
+    for compound in ('layer', 'concat', 'hconcat', 'vconcat'):
+        if getattr(chart, compound, alt.Undefined) is not alt.Undefined:
+            chart = chart.copy(deep=False)
+            subcharts = getattr(chart, compound)
+            if chart.data is not alt.Undefined:
+                # altair moves data shared by all subcharts to the compound chart
+                subcharts = [c.copy(deep=False) for c in subcharts]
+                for c in subcharts:
+                    if c.data is alt.Undefined:
+                        c.data = chart.data
+                chart.data = alt.Undefined
+            setattr(chart, compound, [
+                precompute_transforms(c, **datasource_kwargs) for c in subcharts
+            ])
+            return chart
+    
+    data = chart.data
+    if not isinstance(data, pd.DataFrame):
+        data = exported_data.get(getattr(data, 'url', None))
+    if data is None or chart.transform is alt.Undefined:
+        return chart
+    
+    transforms = [t.to_dict() if hasattr(t, 'to_dict') else t for t in chart.transform]
+    n_precomputed = 0
+    for transform in transforms:
+        result = apply_transform(data, transform)
+        if result is None:
+            break
+        data = result
+        n_precomputed += 1
+    if n_precomputed == 0:
+        return chart
+    
+    data = data.reset_index(drop=True)
+    if isinstance(chart.data, pd.DataFrame) and not datasource_kwargs:
+        # keep the caller's choice, e.g. embed_in_notebook=True
+        datasource = data
+    else:
+        datasource = df_to_datasource(data, **datasource_kwargs)
+    chart = chart.copy(deep=False)
+    chart.data = datasource
+    chart.transform = chart.transform[n_precomputed:] or alt.Undefined
+    return chart
+
+
 def parameter_selection(
         min:float, max:float, step:float, init_value:float, name:str, type:float='range'
-    ) -> alt.selection:
+    ) -> "alt.selection":
     """Return selection bound to parameter input element."""
     b = alt.binding(
         input=type, min=min, max=max, step=step, name=name
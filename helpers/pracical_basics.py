@@ -1,13 +1,63 @@
-import altair as alt
-import pandas as pd
 import numpy as np
 
-def plot_population_vs_sample_mean():
+from . import lazy_import
+from .plotting import df_to_datasource
+
+alt = lazy_import('altair')
+pd  = lazy_import('pandas')
+
+def standard_normal_samples_df(
+        min_samples=10, max_samples=200, seed=0, bin_width=.5, z_max=4, decimals=4
+    ):
+    """Draw max_samples standard normal values once and summarise the first n of them 
+    for each sample size n from min_samples to max_samples.
+    
+    Values from a normal distribution with any mean & std are mean + std * z, 
+    so the charts only have to scale the precomputed values. Returns three DataFrames:
+    
+    - values: t (index of the draw), z
+    - stats: samples, mean_z, se_z (standard error of the mean)
+    - bins: samples, bin_start, bin_end, count; histogram of z with bin_width, without empty bins
+    """
+    z = np.random.default_rng(seed).standard_normal(max_samples)
+    values = pd.DataFrame({'t': np.arange(max_samples), 'z': z.round(decimals)})
+    
+    samples = np.arange(min_samples, max_samples + 1)
+    n = np.arange(1, max_samples + 1)
+    mean_z = np.cumsum(z) / n
+    # sample std via running sums of squares, ddof=1
+    var_z = (np.cumsum(z**2) - n * mean_z**2) / np.maximum(n - 1, 1)
+    stats = pd.DataFrame({
+        'samples': samples,
+        'mean_z':  mean_z[samples - 1].round(decimals),
+        'se_z':    np.sqrt(var_z / n)[samples - 1].round(decimals),
+    })
+    
+    # counts[i, j]: number of the first i+1 values in bin j
+    edges = np.arange(-z_max, z_max + bin_width, bin_width)
+    bin_index = np.clip(np.digitize(z, edges) - 1, 0, len(edges) - 2)
+    counts = np.cumsum(np.eye(len(edges) - 1, dtype=int)[bin_index], axis=0)[samples - 1]
+    sample_index, bin_index = np.nonzero(counts)
+    bins = pd.DataFrame({
+        'samples':   samples[sample_index],
+        'bin_start': edges[bin_index],
+        'bin_end':   edges[bin_index + 1],
+        'count':     counts[sample_index, bin_index],
+    })
+    return values, stats, bins
+
+
+def plot_population_vs_sample_mean(precomputed=False, seed=0):
     """Create interactive plot with random samples from normal distribution.
     Show population & sample mean ± uncertainty, histogram, and sampled values.
+    
+    By default, the browser draws a new sample whenever an input changes. 
+    With precomputed=True, the sample is drawn once with seed (see standard_normal_samples_df) 
+    and only scaled in the browser, so the slides always show the same sample.
     """
     # inputs
     plot_width  = 500
+    min_samples = 10
     max_samples = 200
     input_mean = alt.binding(
         input='range',
@@ -25,7 +75,7 @@ def plot_population_vs_sample_mean():
     )
     input_samples = alt.binding(
         input='range',
-        min=10,
+        min=min_samples,
         max=max_samples,
         step=1,
         name='Sample size'
@@ -93,6 +143,15 @@ def plot_population_vs_sample_mean():
         view=alt.ViewConfig(strokeWidth=0), width=plot_width
     )
 
+    if precomputed:
+        combined_sample = precomputed_sample_chart(
+            standard_normal_samples_df(min_samples, max_samples, seed),
+            scale, plot_width, title_only_ax_kwargs,
+            uncertainty_selection, samples_selection, std_selection, mean_selection
+        )
+        (pop_mean & combined_sample).display(renderer='svg')
+        return
+
     # combined chart with different ways to represent sample 
     data = alt.sequence(0, max_samples, as_='t')
     sample_chart = alt.Chart(data)
@@ -150,23 +209,210 @@ def plot_population_vs_sample_mean():
     (pop_mean & combined_sample).display(renderer='svg')
     
     
+def precomputed_sample_chart(
+        data, scale, plot_width, title_only_ax_kwargs,
+        uncertainty_selection, samples_selection, std_selection, mean_selection
+    ):
+    """Sample mean ± uncertainty, histogram, and sampled values for plot_population_vs_sample_mean
+    from the DataFrames returned by standard_normal_samples_df.
+    """
+    values, stats, bins = data
+    selected_samples = (
+        alt.expr.toNumber(alt.datum.samples) == alt.expr.toNumber(samples_selection.samples)
+    )
+    
+    samp_mean_chart = alt.Chart(
+        df_to_datasource(stats, embed_in_notebook=True)
+    )
+    samp_mean = (
+        samp_mean_chart.mark_errorbar(rule=alt.MarkConfig(size=1.5), ticks=True).encode(
+            x=alt.X(
+                "bar_min:Q", 
+                scale=scale, 
+                axis=alt.Axis(
+                    title="Sample mean ± sample uncertainty", **title_only_ax_kwargs
+                )
+            ),
+            x2='bar_max:Q'
+        ) + samp_mean_chart.mark_point(size=20, filled=True, stroke=None).encode(
+            x='sample_mean:Q'
+        )
+    ).transform_filter(
+        selected_samples
+    ).transform_calculate(
+        mean = mean_selection['mean'],
+        std  = std_selection['std'],
+        ses  = uncertainty_selection['ses'],
+    ).transform_calculate(
+        sample_mean = '+datum.mean + datum.std * datum.mean_z',
+        sample_err  = 'datum.std * datum.se_z',
+    ).transform_calculate(
+        bar_min = '+datum.sample_mean - datum.ses * datum.sample_err',
+        bar_max = '+datum.sample_mean + datum.ses * datum.sample_err'
+    ).properties(
+        view=alt.ViewConfig(strokeWidth=0), width=plot_width
+    )
+
+    hist = alt.Chart(
+        df_to_datasource(bins, embed_in_notebook=True)
+    ).mark_bar(clip=True).encode(
+        alt.X("bin_min:Q", scale=scale, axis=alt.Axis(title='Sample Histogram', **title_only_ax_kwargs)),
+        x2='bin_max:Q',
+        y=alt.Y('count:Q', title='Count'),
+        y2='zero:Q',
+    ).transform_filter(
+        selected_samples
+    ).transform_calculate(
+        mean = mean_selection['mean'],
+        std  = std_selection['std'],
+    ).transform_calculate(
+        bin_min = '+datum.mean + datum.std * datum.bin_start',
+        bin_max = '+datum.mean + datum.std * datum.bin_end',
+        zero = '0',
+    ).properties(
+        width=plot_width,
+        height=100
+    )
+
+    ticks = alt.Chart(
+        df_to_datasource(values, embed_in_notebook=True)
+    ).mark_tick(clip=True).encode(
+        x=alt.X('x:Q', scale=scale, axis=alt.Axis(title='Sample Values'))
+    ).transform_filter(
+        alt.datum.t < alt.expr.toNumber(samples_selection.samples),
+    ).transform_calculate(
+        mean = mean_selection['mean'],
+        std  = std_selection['std'],
+    ).transform_calculate(
+        x = '+datum.mean + datum.std * datum.z', # the plus casts to number
+    ).properties(
+        view=alt.ViewConfig(strokeWidth=0), width=plot_width
+    )
+
+    return (
+        samp_mean & hist & ticks
+    ).add_selection(
+        uncertainty_selection, samples_selection, std_selection, mean_selection
+    )
+    
+    
+def median(samples):
+    """Median along the last axis. 
+    np.partition only moves the middle values into place, which is faster than sorting.
+    """
+    samples = np.asarray(samples)
+    half = samples.shape[-1] // 2
+    if samples.shape[-1] % 2:
+        return np.partition(samples, half, axis=-1)[..., half] * 1.
+    partitioned = np.partition(samples, [half - 1, half], axis=-1)
+    return partitioned[..., half - 1:half + 1].mean(axis=-1)
+
+
+def sample_statistics(samples):
+    """Return dict with statistics of samples along the last axis, 
+    e.g. of one sample or of a 2-D array with one sample per row.
+    """
+    samples = np.asarray(samples)
+    n = samples.shape[-1]
+    mean = samples.mean(axis=-1)
+    sum_of_squared_deviations = np.sum((samples - mean[..., np.newaxis])**2, axis=-1)
+    population_variance = sum_of_squared_deviations / (n - 1) if n > 1 else np.nan * mean
+    return {
+        'sum':                       samples.sum(axis=-1),
+        'mean':                      mean,
+        'median':                    median(samples),
+        'sum_of_squared_deviations': sum_of_squared_deviations,
+        'sample_variance':           sum_of_squared_deviations / n,
+        'sample_std':                np.sqrt(sum_of_squared_deviations / n),
+        'population_variance':       population_variance,
+        'population_std':            np.sqrt(population_variance),
+        'standard_error':            np.sqrt(population_variance) / np.sqrt(n),
+    }
+
+
+def simulate_sample_statistics(population, sample_sizes, n_replicates, seed=0):
+    """Draw n_replicates samples of each size in sample_sizes from population 
+    and return a DataFrame with the statistics of each sample (see sample_statistics).
+    
+    population is either a function population(rng, shape) returning random values, 
+    e.g. lambda rng, shape: rng.normal(0, 1, shape), or a sequence of values that are drawn with replacement.
+    All replicates of one sample size are drawn as one (n_replicates, sample_size) array,
+    so each statistic takes one vectorized pass.
+    """
+    rng = np.random.default_rng(seed)
+    if not callable(population):
+        values = np.asarray(population)
+        population = lambda rng, shape: rng.choice(values, size=shape)
+    res = []
+    for sample_size in sample_sizes:
+        statistics = sample_statistics(population(rng, (n_replicates, sample_size)))
+        del statistics['sum']
+        res.append(pd.DataFrame({
+            'sample_size': sample_size,
+            'replicate':   np.arange(n_replicates),
+            **statistics
+        }))
+    return pd.concat(res, ignore_index=True)
+
+
+def sampling_distribution_df(statistics, statistic='mean', bins=40):
+    """Histogram of a statistic for each sample size, 
+    from the DataFrame returned by simulate_sample_statistics. 
+    Much smaller than the statistics of all replicates, so it can be embedded into slides.
+    """
+    edges = np.histogram_bin_edges(statistics[statistic].dropna(), bins=bins)
+    res = []
+    for sample_size, group in statistics.groupby('sample_size'):
+        counts, _ = np.histogram(group[statistic], bins=edges)
+        res.append(pd.DataFrame({
+            'sample_size': sample_size,
+            'bin_start':   edges[:-1],
+            'bin_end':     edges[1:],
+            'fraction':    counts / len(group),
+        }))
+    return pd.concat(res, ignore_index=True)
+
+
+def plot_sampling_distribution(statistics, statistic='mean', bins=40):
+    """Plot the distribution of a statistic over all replicates for a selectable sample size
+    (statistics from simulate_sample_statistics). The standard deviation of the sample means
+    shrinks like the standard error.
+    """
+    data = sampling_distribution_df(statistics, statistic, bins)
+    sample_sizes = sorted(data['sample_size'].unique())
+    selection = alt.selection_single(
+        bind=alt.binding_select(options=sample_sizes, name='Sample size: '),
+        fields=['sample_size'],
+        init={'sample_size': sample_sizes[0]}
+    )
+    return alt.Chart(
+        df_to_datasource(data, embed_in_notebook=True)
+    ).mark_bar().encode(
+        x=alt.X('bin_start:Q', title=statistic.replace('_', ' ').capitalize()),
+        x2='bin_end:Q',
+        y=alt.Y('fraction:Q', title='Fraction of samples'),
+    ).add_selection(
+        selection
+    ).transform_filter(
+        selection
+    ).properties(
+        width=500,
+        height=200
+    ).display(renderer='svg')
+    
     
 def print_example_statistics(examples, print_only_sample=False):
     for sample in examples:
         print("Values in sample:         ", sample)
         if not print_only_sample:
-            print("Sum of values:            ", np.sum(sample))
-            print("Mean:                     ", np.mean(sample))
-            print("Median:                   ", np.median(sample))
-            print("Sum of deviations:        ", 
-                np.sum(
-                    (np.array(sample) - np.mean(sample))**2
-                )
-            )
-            print("Sample Variance:          ", np.var(sample, ddof=0).round(3))
-            print("Sample Standard deviation:", np.std(sample, ddof=0).round(3))
-            print("Population Variance:      ", np.var(sample, ddof=1).round(3))
-            print("Pop. Standard deviation:  ", np.std(sample, ddof=1).round(3))
-            print("Standard error:           ", (np.std(sample, ddof=1) / np.sqrt(len(sample))).round(3))
+            statistics = sample_statistics(sample)
+            print("Sum of values:            ", statistics['sum'])
+            print("Mean:                     ", statistics['mean'])
+            print("Median:                   ", statistics['median'])
+            print("Sum of deviations:        ", statistics['sum_of_squared_deviations'])
+            print("Sample Variance:          ", statistics['sample_variance'].round(3))
+            print("Sample Standard deviation:", statistics['sample_std'].round(3))
+            print("Population Variance:      ", statistics['population_variance'].round(3))
+            print("Pop. Standard deviation:  ", statistics['population_std'].round(3))
+            print("Standard error:           ", statistics['standard_error'].round(3))
             print()
-
@@ -1,5 +1,4 @@
 """SVGWrapper improves on IPython's SVG class."""
-from IPython.display import SVG
 from shutil import copyfile
 import os
 
@@ -30,6 +29,7 @@ class SVGWrapper():
         Example:
             SVGWrapper('path/to/file.svg', width='50%', height='50%')
         """
+        from IPython.display import SVG
         self.svg = SVG(data=data, url=url, filename=filename, metadata=metadata)
         self.width = width
         self.height = height
@@ -5,27 +5,101 @@
 # more: python make_slides.py --help
 
 import os
+import re
+import sys
+import json
+import ctypes
+import ctypes.util
+import select
+import signal
+import struct
+import hashlib
 import argparse
 from glob import glob
 import subprocess
-from multiprocessing import Process
+from fnmatch import fnmatch
+from threading import Event, Lock, Thread
+from multiprocessing import Process, Queue
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
 import shlex
-from http.server import SimpleHTTPRequestHandler
-from socketserver import TCPServer
-from time import sleep
+import atexit
+import traceback
+import gzip
+import io
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer, HTTPStatus
+from email.utils import formatdate, parsedate_to_datetime
+from time import sleep, monotonic
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import vl_convert
+except ImportError:
+    vl_convert = None
 
 # nb conversion
 INPUT_GLOB    = '*.ipynb'
 OUTPUT_DIR    = 'slides'
 TEMPLATE_DIR  = './nbconvert/templates'
 TEMPLATE_NAME = 'reveal2'
+JOBS          = 1 # number of notebooks to convert in parallel
+HELPERS_DIR   = 'helpers'
+
+# skip conversion if notebook sources and dependencies are unchanged
+CACHE            = True
+# keep one kernel per notebook running for faster conversions
+WARM             = False
+BUILD_CACHE_FILE = '.build_cache.json' # in output dir
+# render the initial state of each chart to svg when converting (needs vl-convert-python),
+# the interactive chart replaces it once its slide is shown
+PRERENDER                   = False
+PRERENDER_VEGA_LITE_VERSION = '5.8' # oldest version vl-convert supports, altair 4 writes 4.17 specs
+# content addressed data exported by helpers.plotting.export_data
+DATA_DIR    = 'data' # in output dir
+DATA_REF_RE = re.compile(r'\bdata/[0-9a-f]{16}\.\w+')
+# images referenced by notebooks (e.g. copied by helpers.svg_wrapper.SVGImg) & slides
+IMAGE_REF_RE = re.compile(r'\bimages/[\w./-]+\.\w+')
+# start of the vega-lite spec passed to the chart rendering function in the slides
+CHART_SPEC_RE = re.compile(r'\}\)\((?=\{)')
+# chart output of altair's html renderer
+ALTAIR_CHART_RE = re.compile(
+    r'<div id="(?P<id>altair-viz-[0-9a-f]+)"></div>\s*<script type="text/javascript">(?P<script>.*?)</script>', 
+    re.DOTALL
+)
+# chart embedded when its slide is shown, see chart_placeholder & helpers.plotting.slide_renderer
+# (attributes in alphabetical order, nbconvert sorts them)
+CHART_PLACEHOLDER_RE = re.compile(
+    r'<div class="vega-chart" id="(?P<id>[\w-]+)">(?P<svg>.*?)</div>\s*'
+    r'<script class="vega-chart-spec" type="application/json">(?P<chart>\{.*?)</script>', 
+    re.DOTALL
+)
+# configs & datasets shared by the charts of a deck, see share_chart_assets
+DECK_ASSETS_RE = re.compile(
+    r'<script class="vega-deck-assets" type="application/json">(?P<assets>\{.*?)</script>', re.DOTALL
+)
+# modules imported by notebooks and helpers
+NOTEBOOK_HELPER_IMPORT_RE = re.compile(r'\bhelpers\.(\w+)')
+HELPER_IMPORT_RE          = re.compile(r'\bfrom\s+\.(\w+)\s+import|\bhelpers\.(\w+)')
+
+# watching
+WATCH          = False
+POLL_INTERVAL  = 2   # seconds, if inotify is not available
+DEBOUNCE       = 1   # seconds without further changes before converting
+CANCEL_POLL    = 0.2 # seconds between checks whether to cancel a running conversion
 
 # serving
 SERVE      = False
-WATCH      = False
 PORT       = 8000
-HOST       = "localhost" # currently fixed
+HOST       = "localhost" # use 0.0.0.0 to serve on your network
+# compression (files are precompressed after converting)
+COMPRESS_EXTENSIONS = ('.html', '.css', '.js', '.json', '.csv', '.svg', '.txt')
+COMPRESS_MIN_SIZE   = 1024 # bytes
+# server-sent events announcing rebuilt decks
+LIVE_RELOAD_PATH       = '/live-reload'
+LIVE_RELOAD_KEEP_ALIVE = 15 # seconds
 
 # template for index with table of contents
 INDEX_TEMPLATE_FILE = 'index.template.html'
@@ -44,21 +118,558 @@ def convert_notebook(
             f" --template {TEMPLATE_NAME}"
         ),
         extra_env = {'CONVERT':'TRUE'},
-        verbose=True
+        verbose=True,
+        cache=None,
+        cancel=None,
+        kernels=None,
+        prerender=PRERENDER
     ):
+    """Convert notebook to slides with nbconvert in a subprocess.
+    
+    If a BuildCache is passed, the conversion is skipped when nothing relevant has changed
+    since the last successful conversion. If the threading.Event cancel is set, 
+    the conversion is stopped. If WarmKernels are passed, the notebook is converted 
+    in-process with an already running kernel instead. 
+    Charts are embedded when their slide is shown, with prerender=True their svg is shown 
+    until then (see postprocess_slides).
+    Returns the finished subprocess (or an equivalent result) or None if skipped.
+    """
     cmd = cmd_tpl.format(
         filename=filename, 
         output_dir=output_dir,
     )
-    env = os.environ.copy()
-    env.update(extra_env)
-    sp = subprocess.run(shlex.split(cmd), env=env, capture_output=True)
+    # data exported by the notebook goes next to the slides
+    extra_env = {**extra_env, 'EXPORT_DIR': output_dir}
+    if cache is not None:
+        key = build_key(filename, cmd, extra_env, {'prerender': prerender})
+        if cache.is_fresh(filename, key):
+            if verbose:
+                print_conversion_log(filename, None)
+            return None
+        
+    with running_conversions:
+        if kernels is not None:
+            sp = kernels.convert(filename, output_dir, extra_env, cancel)
+        else:
+            env = os.environ.copy()
+            env.update(extra_env)
+            sp = run_cancellable(shlex.split(cmd), env, cancel)
+    
+    if sp.returncode == 0:
+        postprocess_slides(os.path.join(output_dir, slides_filename(filename)), output_dir, prerender)
+    
+    if cache is not None and sp.returncode == 0:
+        # remember the slides and the data & images they use, so we can check they still exist
+        # (other notebooks may write to output_dir at the same time, so look up what the slides reference)
+        slides = os.path.join(output_dir, slides_filename(filename))
+        cache.store(
+            filename, key, 
+            {slides} | referenced_data(slides, output_dir) | referenced_images(slides, output_dir)
+        )
     if verbose:
-        print(sp.stdout.decode())
-        print(sp.stderr.decode())
+        print_conversion_log(filename, sp)
     return sp
     
 
+def run_cancellable(args, env, cancel=None):
+    """Run command like subprocess.run with captured output. 
+    Terminate the command and everything it started (e.g. kernels) once cancel is set.
+    """
+    if cancel is not None and cancel.is_set():
+        return subprocess.CompletedProcess(args, -signal.SIGTERM, b'', b'cancelled before start')
+    process = subprocess.Popen(
+        args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
+        start_new_session=hasattr(os, 'killpg')
+    )
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=None if cancel is None else CANCEL_POLL)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel.is_set():
+                if hasattr(os, 'killpg'):
+                    os.killpg(process.pid, signal.SIGTERM)
+                else:
+                    process.terminate()
+                cancel = None # just collect the output now
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+    
+
+class WarmKernels():
+    # forget variables & edited helpers from the last run, 
+    # but keep the already imported libraries
+    RESET_CODE = "\n".join([
+        "import sys",
+        "for _module in [m for m in sys.modules if m == 'helpers' or m.startswith('helpers.')]:",
+        "    del sys.modules[_module]",
+        "if 'altair' in sys.modules:",
+        "    for _registry in ('data_transformers', 'renderers', 'themes'):",
+        "        getattr(sys.modules['altair'], _registry).enable('default')",
+        "    # same selection names as in a fresh kernel",
+        "    if hasattr(sys.modules['altair'], 'Selection'):",
+        "        sys.modules['altair'].Selection._counter = 0",
+        "%reset -f",
+    ])
+    
+    def __init__(self, template_dir=TEMPLATE_DIR, template_name=TEMPLATE_NAME):
+        """Convert notebooks in-process, keeping one running kernel per notebook.
+        
+        Compared to one jupyter nbconvert --execute process per conversion, this saves the
+        startup of the interpreter & kernel and importing libraries for every rebuild.
+        The kernel namespace is reset between runs.
+        """
+        # only needed in this mode
+        import nbformat
+        from nbclient import NotebookClient
+        from nbconvert import SlidesExporter
+        from jupyter_client import KernelManager
+        self.nbformat = nbformat
+        self.NotebookClient = NotebookClient
+        self.KernelManager = KernelManager
+        # same options as --to slides --no-input
+        self.exporter = SlidesExporter(
+            template_name=template_name,
+            extra_template_basedirs=[template_dir],
+            exclude_input=True,
+            exclude_input_prompt=True,
+            exclude_output_prompt=True,
+        )
+        self.kernels = {} # notebook filename: (kernel manager, environment)
+        self.lock = Lock()
+        atexit.register(self.shutdown)
+        
+    def kernel(self, filename, extra_env):
+        "Return running kernel manager for notebook, started with extra_env"
+        with self.lock:
+            km, env = self.kernels.get(filename, (None, None))
+            if km is not None and (env != extra_env or not km.is_alive()):
+                km.shutdown_kernel(now=True)
+                km = None
+            if km is None:
+                km = self.KernelManager()
+                kernel_env = os.environ.copy()
+                kernel_env.update(extra_env)
+                km.start_kernel(cwd=os.path.dirname(os.path.abspath(filename)), env=kernel_env)
+                self.kernels[filename] = (km, dict(extra_env))
+            return km
+        
+    def convert(self, filename, output_dir, extra_env, cancel=None):
+        """Execute notebook in its warm kernel and export it to output_dir. 
+        Interrupt the kernel when cancel is set. Returns a subprocess.CompletedProcess.
+        """
+        args = ['warm kernel', filename]
+        km = self.kernel(filename, extra_env)
+        nb = self.nbformat.read(filename, as_version=4)
+        path = os.path.dirname(os.path.abspath(filename))
+        client = self.NotebookClient(nb, km=km, timeout=None, resources={'metadata': {'path': path}})
+        
+        # interrupt the kernel if cancelled
+        finished = Event()
+        def interrupt_on_cancel():
+            while not finished.wait(CANCEL_POLL):
+                if cancel.is_set():
+                    km.interrupt_kernel()
+                    break
+        if cancel is not None:
+            Thread(target=interrupt_on_cancel, daemon=True).start()
+        try:
+            # run the reset as an extra first cell & remove it before exporting
+            nb.cells.insert(0, self.nbformat.v4.new_code_cell(self.RESET_CODE))
+            client.execute()
+            nb.cells.pop(0)
+            name = os.path.splitext(os.path.basename(filename))[0]
+            body, resources = self.exporter.from_notebook_node(
+                nb, resources={'metadata': {'name': name, 'path': path}}
+            )
+            output_file = os.path.join(output_dir, name + resources['output_extension'])
+            with open(output_file, 'w') as f:
+                f.write(body)
+        except Exception:
+            returncode = -signal.SIGTERM if cancel is not None and cancel.is_set() else 1
+            return subprocess.CompletedProcess(args, returncode, b'', traceback.format_exc().encode())
+        finally:
+            finished.set()
+            if client.kc is not None:
+                client.kc.stop_channels()
+        return subprocess.CompletedProcess(args, 0, f"Wrote {output_file}".encode(), b'')
+    
+    def shutdown(self):
+        with self.lock:
+            for km, env in self.kernels.values():
+                km.shutdown_kernel(now=True)
+            self.kernels = {}
+    
+
+class RunningConversions():
+    def __init__(self):
+        """Count conversions in progress. 
+        Data exported by a running conversion isn't referenced by its slides yet,
+        so garbage collection has to wait until no conversion is running.
+        """
+        self.count = 0
+        self.lock  = Lock()
+        
+    def __enter__(self):
+        with self.lock:
+            self.count += 1
+            
+    def __exit__(self, *exc_info):
+        with self.lock:
+            self.count -= 1
+
+
+running_conversions = RunningConversions()
+
+
+def referenced_data(html_filename, output_dir):
+    "Return the set of data files in output_dir referenced by an html file"
+    try:
+        with open(html_filename, 'r', encoding='utf-8') as f:
+            html = f.read()
+    except FileNotFoundError:
+        return set()
+    return {os.path.join(output_dir, url) for url in DATA_REF_RE.findall(html)}
+    
+    
+def referenced_images(html_filename, output_dir):
+    "Return the set of existing images in output_dir referenced by an html file"
+    try:
+        with open(html_filename, 'r', encoding='utf-8') as f:
+            html = f.read()
+    except FileNotFoundError:
+        return set()
+    paths = {os.path.join(output_dir, url) for url in IMAGE_REF_RE.findall(html)}
+    # e.g. the logo in the template is not copied by notebooks
+    return {path for path in paths if os.path.isfile(path)}
+
+
+def collect_garbage(output_dir):
+    """Delete data files (and their compressed versions) not referenced by any slides in output_dir.
+    Skipped while conversions are running.
+    """
+    with running_conversions.lock:
+        if running_conversions.count > 0:
+            return
+        referenced = set()
+        for html_filename in glob(os.path.join(output_dir, '*.html')):
+            referenced |= referenced_data(html_filename, output_dir)
+        for filename in glob(os.path.join(output_dir, DATA_DIR, '*')):
+            if filename not in referenced and not filename.endswith(('.gz', '.br')):
+                for f in (filename, filename + '.gz', filename + '.br'):
+                    if os.path.exists(f):
+                        os.remove(f)
+                print(f"Removed unused {filename}")
+    
+
+def chart_specs(html):
+    "Yield the vega-lite specs of the altair charts in the html of a slide deck"
+    decoder = json.JSONDecoder()
+    for match in CHART_SPEC_RE.finditer(html):
+        try:
+            spec, _ = decoder.raw_decode(html, match.end())
+        except json.JSONDecodeError:
+            continue
+        if '$schema' in spec:
+            yield spec
+    assets = deck_assets(html)
+    for match in CHART_PLACEHOLDER_RE.finditer(html):
+        try:
+            chart = json.loads(match.group('chart')) # "<\\/" is valid json
+        except json.JSONDecodeError:
+            continue
+        yield full_spec(chart, assets)
+            
+
+def chart_data(spec):
+    "Yield the datasets embedded in a (nested) vega-lite spec & the urls of linked data"
+    if isinstance(spec, dict):
+        yield from (('embedded', values) for values in spec.get('datasets', {}).values())
+        data = spec.get('data')
+        if isinstance(data, dict) and 'values' in data:
+            yield 'embedded', data['values']
+        elif isinstance(data, dict) and 'url' in data:
+            yield 'linked', data['url']
+        for key, value in spec.items():
+            if key not in ('datasets', 'data'):
+                yield from chart_data(value)
+    elif isinstance(spec, list):
+        for value in spec:
+            yield from chart_data(value)
+            
+
+def print_data_report(slides, output_dir):
+    "Print how much data the charts in the slides embed & load from urls"
+    try:
+        with open(slides, 'r', encoding='utf-8') as f:
+            specs = list(chart_specs(f.read()))
+    except FileNotFoundError:
+        return
+    # datasets used by several charts are only embedded once (see share_chart_assets)
+    embedded = set()
+    urls = set()
+    for spec in specs:
+        for kind, data in chart_data(spec):
+            if kind == 'embedded':
+                embedded.add(json.dumps(data))
+            else:
+                urls.add(data)
+    embedded = sum(len(data) for data in embedded)
+    paths  = [os.path.join(output_dir, url) for url in urls]
+    linked = sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+    print(
+        f"{os.path.basename(slides)}: {len(specs)} charts, "
+        f"{embedded / 1000:.1f} kB data embedded, {linked / 1000:.1f} kB linked ({len(urls)} files)"
+    )
+
+
+def inline_linked_data(spec, output_dir):
+    "Return a copy of spec with data loaded from urls in output_dir replaced by the values"
+    if isinstance(spec, list):
+        return [inline_linked_data(value, output_dir) for value in spec]
+    if not isinstance(spec, dict):
+        return spec
+    spec = {key: inline_linked_data(value, output_dir) for key, value in spec.items()}
+    data = spec.get('data')
+    if isinstance(data, dict) and 'url' in data and os.path.isfile(os.path.join(output_dir, data['url'])):
+        import pandas as pd # only needed here
+        data_format = data.get('format', {})
+        path = os.path.join(output_dir, data['url'])
+        if data_format.get('type', 'csv') == 'csv':
+            df = pd.read_csv(path)
+            for column, dtype in data_format.get('parse', {}).items():
+                if dtype == 'boolean':
+                    df[column] = df[column].astype(bool)
+            values = json.loads(df.to_json(orient='records'))
+        else:
+            with open(path, 'r') as f:
+                values = json.load(f)
+        spec['data'] = {'values': values}
+    return spec
+
+
+def join_fonts(spec):
+    "Return a copy of spec with lists of fonts joined to a css font-family, browsers do this implicitly"
+    if isinstance(spec, list):
+        return [join_fonts(value) for value in spec]
+    if not isinstance(spec, dict):
+        return spec
+    return {
+        key: ', '.join(value) if key.endswith(('font', 'Font')) and isinstance(value, list) else join_fonts(value)
+        for key, value in spec.items()
+    }
+
+
+def prerender_chart(spec, output_dir):
+    "Return the chart rendered to svg by vl-convert or None if that fails"
+    try:
+        return vl_convert.vegalite_to_svg(
+            join_fonts(inline_linked_data(spec, output_dir)), vl_version=PRERENDER_VEGA_LITE_VERSION
+        )
+    except Exception as e:
+        print(f"Could not prerender chart: {str(e).splitlines()[0]}")
+        return None
+    
+
+def chart_placeholder(chart_id, chart, svg=None):
+    """Html for a chart that is embedded once its slide is shown (by the script in the template), 
+    like the output of helpers.plotting.slide_renderer. chart holds the spec & embedOptions.
+    If given, the svg is shown in the meantime.
+    """
+    # "</" would end the script
+    chart_json = json.dumps(chart).replace('</', '<\\/')
+    return (
+        f'<div class="vega-chart" id="{chart_id}">{svg or ""}</div>\n'
+        f'<script class="vega-chart-spec" type="application/json">{chart_json}</script>'
+    )
+
+
+def rewrite_charts(html, output_dir, prerender=PRERENDER):
+    """Replace the charts output by altair's html renderer by placeholders, 
+    and optionally render the svg of all placeholders.
+    """
+    decoder = json.JSONDecoder()
+    def rewrite_altair_chart(match):
+        script = match.group('script')
+        start = CHART_SPEC_RE.search(script)
+        if start is None:
+            return match.group(0)
+        try:
+            spec, end = decoder.raw_decode(script, start.end())
+            embed_options, _ = decoder.raw_decode(script, script.index('{', end))
+        except (json.JSONDecodeError, ValueError):
+            return match.group(0)
+        return chart_placeholder(match.group('id'), {'spec': spec, 'embedOptions': embed_options})
+    def prerender_placeholder(match):
+        if match.group('svg'):
+            return match.group(0)
+        chart = json.loads(match.group('chart'))
+        svg = prerender_chart(chart['spec'], output_dir)
+        if svg is None:
+            return match.group(0)
+        return chart_placeholder(match.group('id'), chart, svg)
+    html = ALTAIR_CHART_RE.sub(rewrite_altair_chart, html)
+    if prerender:
+        html = CHART_PLACEHOLDER_RE.sub(prerender_placeholder, html)
+    return html
+
+
+def deck_assets(html):
+    "Configs & datasets shared by the charts in the html of a deck"
+    match = DECK_ASSETS_RE.search(html)
+    if match is None:
+        return {'configs': {}, 'datasets': {}}
+    return json.loads(match.group('assets'))
+
+
+def full_spec(chart, assets):
+    "The spec of a chart with the shared config & datasets it refers to filled in"
+    spec = dict(chart['spec'])
+    if 'config' in chart:
+        spec['config'] = assets['configs'][chart['config']]
+    if 'datasets' in chart:
+        spec['datasets'] = {name: assets['datasets'][name] for name in chart['datasets']}
+    return spec
+
+
+def share_chart_assets(html):
+    """Move the configs & datasets of the charts in the html of a deck to one script,
+    each chart only keeps their keys. Charts with the same theme or data don't repeat it 
+    (altair names datasets by a hash of their values). The template puts the spec back together.
+    """
+    assets = deck_assets(html)
+    def share(match):
+        chart = json.loads(match.group('chart'))
+        spec = dict(chart['spec'])
+        if 'config' in spec:
+            config = spec.pop('config')
+            key = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+            assets['configs'][key] = config
+            chart['config'] = key
+        if 'datasets' in spec:
+            datasets = spec.pop('datasets')
+            assets['datasets'].update(datasets)
+            chart['datasets'] = list(datasets)
+        chart['spec'] = spec
+        return chart_placeholder(match.group('id'), chart, match.group('svg'))
+    html = CHART_PLACEHOLDER_RE.sub(share, DECK_ASSETS_RE.sub('', html))
+    if not assets['configs'] and not assets['datasets']:
+        return html
+    # "</" would end the script
+    assets_json = json.dumps(assets).replace('</', '<\\/')
+    head, body_end, tail = html.rpartition('</body>')
+    return (
+        f'{head}<script class="vega-deck-assets" type="application/json">{assets_json}</script>\n'
+        f'{body_end}{tail}'
+    )
+
+
+def postprocess_slides(slides, output_dir, prerender=PRERENDER):
+    "Rewrite the charts in the slides (see rewrite_charts) & share their assets (see share_chart_assets)"
+    if prerender and vl_convert is None:
+        print("Install vl-convert-python to prerender charts")
+        prerender = False
+    with open(slides, 'r', encoding='utf-8') as f:
+        html = f.read()
+    rewritten = share_chart_assets(rewrite_charts(html, output_dir, prerender))
+    if rewritten != html:
+        with open(slides, 'w', encoding='utf-8') as f:
+            f.write(rewritten)
+
+
+def print_conversion_log(filename, sp):
+    """Print captured output of a notebook conversion as one block, 
+    sp is None if the conversion was skipped.
+    """
+    if sp is None:
+        print(f"{filename} is unchanged, skipping conversion")
+        return
+    print(
+        f"==== {filename} (exit code {sp.returncode}) ====\n"
+        f"{sp.stdout.decode()}\n"
+        f"{sp.stderr.decode()}"
+    )
+    
+
+def helper_dependencies(notebook_filename, helpers_dir=HELPERS_DIR):
+    """Return the helper modules a notebook imports, directly or via other helpers.
+    Rather too many than too few, because also helpers mentioned e.g. in comments are found.
+    """
+    with open(notebook_filename, 'r') as f:
+        modules = set(NOTEBOOK_HELPER_IMPORT_RE.findall(f.read()))
+    dependencies = {os.path.join(helpers_dir, '__init__.py')}
+    while modules:
+        module_file = os.path.join(helpers_dir, modules.pop() + '.py')
+        if module_file in dependencies or not os.path.exists(module_file):
+            continue
+        dependencies.add(module_file)
+        with open(module_file, 'r') as f:
+            for match in HELPER_IMPORT_RE.findall(f.read()):
+                modules.update(m for m in match if m)
+    return sorted(dependencies)
+    
+    
+def build_key(notebook_filename, cmd, extra_env, options={}):
+    """Hash everything that affects the converted slides: notebook sources (not outputs), 
+    imported helpers, images referenced by the notebook, template, command, environment & other options.
+    """
+    h = hashlib.sha256()
+    with open(notebook_filename, 'r') as f:
+        nb = json.load(f)
+    cells = [
+        {
+            'cell_type': cell['cell_type'], 
+            'source':    ''.join(cell['source']), 
+            'metadata':  cell.get('metadata', {})
+        }
+        for cell in nb['cells']
+    ]
+    h.update(json.dumps(
+        [cells, nb.get('metadata', {}), cmd, extra_env, options], sort_keys=True
+    ).encode())
+    template_files = sorted(glob(os.path.join(TEMPLATE_DIR, TEMPLATE_NAME, '*')))
+    # images are only copied to the output dir while the notebook runs (see helpers.svg_wrapper.SVGImg)
+    notebook_dir = os.path.dirname(notebook_filename)
+    images = sorted({
+        os.path.join(notebook_dir, url) for cell in cells for url in IMAGE_REF_RE.findall(cell['source'])
+    })
+    for dependency in helper_dependencies(notebook_filename) + template_files + images:
+        if not os.path.isfile(dependency):
+            h.update(f'missing {dependency}'.encode())
+            continue
+        h.update(dependency.encode())
+        with open(dependency, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+    
+
+class BuildCache():
+    def __init__(self, output_dir, filename=BUILD_CACHE_FILE):
+        """Persistent record of the build key and output files of each converted notebook."""
+        self.path = os.path.join(output_dir, filename)
+        self.lock = Lock() # notebooks can be converted in parallel threads
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+            
+    def is_fresh(self, notebook_filename, key):
+        "True if the notebook was converted with the same key and all outputs still exist"
+        entry = self.entries.get(notebook_filename)
+        return (
+            entry is not None
+            and entry['key'] == key
+            and all(os.path.exists(f) for f in entry['outputs'])
+        )
+    
+    def store(self, notebook_filename, key, outputs):
+        with self.lock:
+            self.entries[notebook_filename] = {'key': key, 'outputs': sorted(outputs)}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w') as f:
+                json.dump(self.entries, f, indent=1)
+    
+
 def make_index(output_dir):
     """Create index.html with list of slide decks (.html files in output dir)
     """
@@ -89,78 +700,508 @@ def make_index(output_dir):
         f.write(index_page)
         
 
+# index, garbage collection and compression scan the whole output dir,
+# watching with jobs > 1 may finish several conversions at the same time
+update_outputs_lock = Lock()
+
+
+def update_outputs(output_dir):
+    "Update the index, remove unused data and compress the output dir, one caller at a time"
+    with update_outputs_lock:
+        make_index(output_dir)
+        collect_garbage(output_dir)
+        precompress(output_dir)
+
+
+def slides_filename(notebook_filename):
+    "Name of the converted slides in the output dir"
+    return os.path.splitext(os.path.basename(notebook_filename))[0] + '.slides.html'
+
+
 def convert_notebook_and_update_index(
-        notebook_filename, output_dir, **convert_nb_kwargs
+        notebook_filename, output_dir, notify=None, **convert_nb_kwargs
+    ):
+    """Convert notebook & update index. 
+    Call notify(slides_filename) if the slides were rebuilt successfully.
+    """
+    sp = convert_notebook(notebook_filename, output_dir, **convert_nb_kwargs)
+    if sp is not None and sp.returncode == 0:
+        print_data_report(os.path.join(output_dir, slides_filename(notebook_filename)), output_dir)
+    update_outputs(output_dir)
+    if notify is not None and sp is not None and sp.returncode == 0:
+        notify(slides_filename(notebook_filename))
+    
+
+def convert_notebooks_and_update_index(
+        notebook_filenames, output_dir, jobs=JOBS, notify=None, **convert_nb_kwargs
     ):
-    convert_notebook(notebook_filename, output_dir, **convert_nb_kwargs)
-    make_index(output_dir)
+    """Convert up to jobs notebooks at the same time, then update the index once.
+    The output of each conversion is printed as one block when it is finished.
+    Call notify(slides_filename) for each rebuilt deck.
+    """
+    convert_nb_kwargs['verbose'] = False
+    # each thread only waits for its own nbconvert subprocess
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(convert_notebook, filename, output_dir, **convert_nb_kwargs): filename
+            for filename in notebook_filenames
+        }
+        rebuilt = []
+        for future in as_completed(futures):
+            sp = future.result()
+            print_conversion_log(futures[future], sp)
+            if sp is not None and sp.returncode == 0:
+                rebuilt.append(futures[future])
+                print_data_report(os.path.join(output_dir, slides_filename(futures[future])), output_dir)
+    update_outputs(output_dir)
+    if notify is not None:
+        for filename in rebuilt:
+            notify(slides_filename(filename))
 
 
-def serve(directory, port):
-    "See https://docs.python.org/2/library/simplehttpserver.html"
-    Handler = partial(SimpleHTTPRequestHandler, directory=directory)
+def is_compressible(filename):
+    return filename.endswith(COMPRESS_EXTENSIONS)
+
+
+def is_immutable(filename):
+    "Content addressed data never changes, its name changes instead"
+    return os.path.basename(os.path.dirname(filename)) == DATA_DIR and bool(DATA_REF_RE.search(filename))
+
+
+def precompress(output_dir):
+    """Write .gz (and .br if brotli is installed) next to each compressible file in output_dir,
+    unless they are already up to date.
+    """
+    compressors = {'.gz': partial(gzip.compress, compresslevel=9)}
+    if brotli is not None:
+        compressors['.br'] = brotli.compress
+    for filename in glob(os.path.join(output_dir, '**', '*'), recursive=True):
+        if (
+            not is_compressible(filename) 
+            or not os.path.isfile(filename) 
+            or os.path.getsize(filename) < COMPRESS_MIN_SIZE
+        ):
+            continue
+        mtime = os.path.getmtime(filename)
+        data = None
+        for extension, compress in compressors.items():
+            compressed = filename + extension
+            if os.path.exists(compressed) and (
+                is_immutable(filename) or os.path.getmtime(compressed) >= mtime
+            ):
+                continue
+            if data is None:
+                with open(filename, 'rb') as f:
+                    data = f.read()
+            # the server may send the compressed file meanwhile, so replace it only once complete
+            tmp_path = f'{compressed}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(compress(data))
+            os.replace(tmp_path, compressed)
+
+
+class LiveReload():
+    def __init__(self, messages):
+        """Forward messages from a multiprocessing.Queue to all subscribed clients."""
+        self.messages = messages
+        self.clients  = set()
+        self.lock     = Lock()
+        Thread(target=self.broadcast, daemon=True).start()
+        
+    def broadcast(self):
+        while True:
+            message = self.messages.get()
+            with self.lock:
+                for client in self.clients:
+                    client.put(message)
+                    
+    def subscribe(self):
+        client = queue.Queue()
+        with self.lock:
+            self.clients.add(client)
+        return client
+    
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+
+class SlideRequestHandler(SimpleHTTPRequestHandler):
+    """Serve files with compression, ETag / Last-Modified validation and range requests.
+    
+    Precompressed .br or .gz files are used if they are up to date, other compressible 
+    files are gzipped on the fly. Directories are handled by SimpleHTTPRequestHandler.
+    If the server has a LiveReload, LIVE_RELOAD_PATH streams the names of rebuilt decks 
+    as server-sent events.
+    """
+    
+    def do_GET(self):
+        live_reload = getattr(self.server, 'live_reload', None)
+        if live_reload is not None and self.path.split('?')[0] == LIVE_RELOAD_PATH:
+            self.send_events(live_reload)
+        else:
+            super().do_GET()
+            
+    def send_events(self, live_reload):
+        "Keep connection open & send one event per rebuilt deck"
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        client = live_reload.subscribe()
+        try:
+            while True:
+                try:
+                    deck = client.get(timeout=LIVE_RELOAD_KEEP_ALIVE)
+                    self.wfile.write(f"data: {deck}\n\n".encode())
+                except queue.Empty:
+                    # comment line, lets us notice closed connections
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            live_reload.unsubscribe(client)
+    
+    def send_head(self):
+        path = self.translate_path(self.path)
+        index = os.path.join(path, 'index.html')
+        if os.path.isdir(path) and self.path.split('?')[0].endswith('/') and os.path.isfile(index):
+            path = index
+        if not os.path.isfile(path):
+            return super().send_head()
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return super().send_head()
+        st = os.fstat(f.fileno())
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        
+        # tell the client to use its cached copy if it is still valid
+        if self.not_modified(etag, st.st_mtime):
+            f.close()
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+        
+        if 'Range' in self.headers:
+            return self.send_range(f, st, etag, path)
+        
+        encoding, body = self.encoded_body(f, st, path)
+        if encoding is not None:
+            # one etag per representation
+            etag = etag[:-1] + '-' + encoding + '"'
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-type", self.guess_type(path))
+        self.send_header("Content-Length", str(body.seek(0, io.SEEK_END)))
+        body.seek(0)
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_common_headers(st, etag, path)
+        self.end_headers()
+        return body
+    
+    def not_modified(self, etag, mtime):
+        if 'If-None-Match' in self.headers:
+            # also accept the etags of compressed versions of the same file
+            file_version = etag.strip('"').split('-')[:2]
+            for tag in self.headers['If-None-Match'].split(','):
+                tag = tag.strip()
+                if tag.startswith('W/'):
+                    tag = tag[2:]
+                if tag == '*' or tag.strip('"').split('-')[:2] == file_version:
+                    return True
+            return False
+        if 'If-Modified-Since' in self.headers:
+            try:
+                since = parsedate_to_datetime(self.headers['If-Modified-Since'])
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
+    
+    def encoded_body(self, f, st, path):
+        "Return content encoding (or None) and file-like body"
+        accepted = self.headers.get('Accept-Encoding', '')
+        if is_compressible(path):
+            for encoding, extension in (('br', '.br'), ('gzip', '.gz')):
+                compressed = path + extension
+                if (
+                    encoding in accepted
+                    and os.path.exists(compressed) 
+                    and os.path.getmtime(compressed) >= st.st_mtime
+                ):
+                    f.close()
+                    return encoding, open(compressed, 'rb')
+            if 'gzip' in accepted and st.st_size >= COMPRESS_MIN_SIZE:
+                with f:
+                    return 'gzip', io.BytesIO(gzip.compress(f.read(), compresslevel=6))
+        return None, f
     
-    with TCPServer((HOST, port), Handler) as httpd:
-        print(f"serving {directory} at http://{HOST}:{port}")
+    def send_range(self, f, st, etag, path):
+        "Send a single byte range of the uncompressed file"
+        size = st.st_size
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers['Range'].strip())
+        if match and match.group(1):
+            start = int(match.group(1))
+            end   = min(int(match.group(2) or size - 1), size - 1)
+        elif match and match.group(2):
+            # suffix range: the last n bytes
+            start, end = max(size - int(match.group(2)), 0), size - 1
+        else:
+            # invalid or multiple ranges
+            start, end = 0, -1
+        if start > end:
+            f.close()
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return None
+        with f:
+            f.seek(start)
+            body = io.BytesIO(f.read(end - start + 1))
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_header("Content-type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_common_headers(st, etag, path)
+        self.end_headers()
+        return body
+    
+    def send_common_headers(self, st, etag, path):
+        self.send_header("Last-Modified", formatdate(st.st_mtime, usegmt=True))
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        if is_immutable(path):
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        else:
+            # files change when slides are rebuilt, so always revalidate (cheap with 304s)
+            self.send_header("Cache-Control", "no-cache")
+        if is_compressible(path):
+            self.send_header("Vary", "Accept-Encoding")
+
+
+def serve(directory, port, host=HOST, messages=None):
+    """Serve directory with one thread per request.
+    Names of rebuilt decks put into the multiprocessing.Queue messages are sent to live reload clients.
+    """
+    Handler = partial(SlideRequestHandler, directory=directory)
+    
+    with ThreadingHTTPServer((host, port), Handler) as httpd:
+        if messages is not None:
+            httpd.live_reload = LiveReload(messages)
+        print(f"serving {directory} at http://{host}:{port}")
         httpd.serve_forever()
 
 
 class Server():
-    def __init__(self, directory, port):
+    def __init__(self, directory, port, host=HOST):
         self.directory = directory
         self.port      = port
+        self.host      = host
         self.process   = None
+        self.messages  = Queue()
         
     def start(self):
         if self.process is not None:
             self.stop()
-        self.process = Process(target=serve, args=[self.directory, self.port])
+        self.process = Process(
+            target=serve, args=[self.directory, self.port, self.host, self.messages]
+        )
         self.process.start()
         print("Started server with pid", self.process.pid)
+        
+    def notify(self, deck):
+        "Tell open browser tabs showing deck to reload"
+        self.messages.put(deck)
        
     def stop(self):
         self.process.terminate()
         print("Stopped server with pid", self.process.pid)
 
 
+class Inotify():
+    # see man inotify
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    EVENT_HEADER   = struct.Struct('iIII')
+    
+    def __init__(self, directories):
+        """Minimal ctypes wrapper around Linux inotify to wait for files written in directories.
+        Raises OSError if inotify is not available.
+        """
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+            )
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self.directories[wd] = directory
+            
+    def read(self, timeout=None):
+        "Wait up to timeout seconds (None: forever) for changes and return changed files"
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        buffer = os.read(self.fd, 64 * 1024)
+        files  = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name and wd in self.directories:
+                files.append(os.path.normpath(os.path.join(self.directories[wd], os.fsdecode(name))))
+        return files
+    
+    def close(self):
+        os.close(self.fd)
+
+
 class Watcher():
-    def __init__(self, glob_pattern, callback):
+    def __init__(
+            self, glob_pattern, callback, batch_callback=None, jobs=JOBS, helpers_dir=HELPERS_DIR
+        ):
+        """Call callback(filename) for each new or changed file matching glob_pattern.
+        
+        If batch_callback is given, update calls batch_callback(list_of_filenames) once for 
+        all changed files instead. When watching, callback is called with an additional 
+        threading.Event cancel, that is set when the file changes again before the callback
+        is finished. Up to jobs callbacks are run in parallel.
+        Changes to helpers trigger the callback for all files that import them.
+        """
         self.glob_pattern = glob_pattern
         self.callback = callback
+        self.batch_callback = batch_callback
+        self.jobs = jobs
+        self.helpers_dir = helpers_dir
+        self.helpers_glob = os.path.join(helpers_dir, '*.py')
         nb_files = glob(self.glob_pattern)
         self.last_changes = {
             file: 0 for file in nb_files
         }
+        # only changes to helpers after starting are relevant
+        self.last_changes.update({
+            file: os.path.getmtime(file) for file in glob(self.helpers_glob)
+        })
         
-        
-    def update(self):
-        nb_files = glob(self.glob_pattern)
+    def changed_files(self, glob_pattern=None):
+        "Return new or changed files and remember their modification times"
+        changed = []
+        nb_files = glob(glob_pattern or self.glob_pattern)
         for file in nb_files:
             last_change = os.path.getmtime(file)
             if (
                 not file in self.last_changes
                 or last_change > self.last_changes[file]
             ):
-                self.callback(file)
+                changed.append(file)
                 self.last_changes[file] = last_change
+        return changed
+        
+    def affected_files(self, changed):
+        "Return watched files that are changed or depend on changed helpers"
+        nb_files = [os.path.normpath(f) for f in glob(self.glob_pattern)]
+        affected = set(f for f in changed if f in nb_files)
+        changed_helpers = set(f for f in changed if fnmatch(f, self.helpers_glob))
+        if changed_helpers:
+            affected.update(
+                f for f in nb_files 
+                if changed_helpers.intersection(helper_dependencies(f, self.helpers_dir))
+            )
+        return sorted(affected)
+        
+    def update(self):
+        changed = self.changed_files()
+        if self.batch_callback is not None:
+            if changed:
+                self.batch_callback(changed)
+        else:
+            for file in changed:
+                self.callback(file)
 
     def watch(self):
-        while True:
-            self.update()
-            sleep(2)
+        """Convert all changed files, then wait for further changes.
+        Uses inotify where available and falls back to polling.
+        """
+        self.update()
+        try:
+            inotify = Inotify(set(
+                os.path.dirname(pattern) or '.' for pattern in (self.glob_pattern, self.helpers_glob)
+            ))
+            print("watching for changes with inotify")
+        except OSError as e:
+            inotify = None
+            print(f"watching for changes every {POLL_INTERVAL}s ({e})")
+            
+        pending = {} # file: time of last change
+        running = {} # file: (future, cancel event)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while True:
+                # wait for changes
+                if inotify is not None:
+                    changed = inotify.read(timeout=DEBOUNCE if pending else None)
+                else:
+                    sleep(DEBOUNCE if pending else POLL_INTERVAL)
+                    changed = [
+                        os.path.normpath(f) 
+                        for f in self.changed_files() + self.changed_files(self.helpers_glob)
+                    ]
+                
+                # wait until a burst of changes (e.g. by autosave) is over, 
+                # stop outdated conversions
+                now = monotonic()
+                for file in self.affected_files(changed):
+                    pending[file] = now
+                    if file in running:
+                        running.pop(file)[1].set()
+                
+                # start conversions in the background
+                for file, last_change in list(pending.items()):
+                    if now - last_change >= DEBOUNCE:
+                        del pending[file]
+                        cancel = Event()
+                        running[file] = (executor.submit(self.callback, file, cancel=cancel), cancel)
+                for file, (future, cancel) in list(running.items()):
+                    if future.done():
+                        del running[file]
 
 
-def main(input_glob, output_dir, serve, watch, port):
+def main(
+        input_glob, output_dir, serve, watch, port, jobs=JOBS, cache=CACHE, warm=WARM, host=HOST,
+        prerender=PRERENDER
+    ):
     
     if serve:
-        server = Server(output_dir, port)
+        server = Server(output_dir, port, host)
         server.start()
     else:
         server = None
     
+    build_cache = BuildCache(output_dir) if cache else None
+    kernels = WarmKernels() if warm else None
+    notify  = server.notify if server is not None else None
     watcher = Watcher(
         input_glob, 
-        partial(convert_notebook_and_update_index, output_dir=output_dir)
+        partial(
+            convert_notebook_and_update_index, 
+            output_dir=output_dir, cache=build_cache, kernels=kernels, notify=notify, prerender=prerender
+        ),
+        batch_callback=partial(
+            convert_notebooks_and_update_index, 
+            output_dir=output_dir, jobs=jobs, cache=build_cache, kernels=kernels, notify=notify,
+            prerender=prerender
+        ) if jobs > 1 else None,
+        jobs=jobs
     )
     
     if watch:
@@ -214,7 +1255,39 @@ if __name__ == '__main__':
         type=int,
         help=f'Port for serving (default: {PORT})'
     )   
+    parser.add_argument(
+        '--host', 
+        default=HOST,
+        help=f'Address for serving, e.g. 0.0.0.0 to make the slides available on your network (default: {HOST})'
+    )   
+    parser.add_argument(
+        '--jobs', 
+        default=JOBS,
+        type=int,
+        help=f'Number of notebooks to convert in parallel (default: {JOBS})'
+    )   
+    parser.add_argument(
+        '--cache', 
+        default=CACHE,
+        type=str2bool,
+        help=f'Skip notebooks if sources, helpers & template are unchanged since the last conversion (default: {CACHE})'
+    )   
+    parser.add_argument(
+        '--warm', 
+        default=WARM,
+        type=str2bool,
+        help=f'Keep one kernel per notebook running and convert in-process, for fast rebuilds while watching (default: {WARM})'
+    )   
+    parser.add_argument(
+        '--prerender', 
+        default=PRERENDER,
+        type=str2bool,
+        help=f'Render the charts to svg at build time and make them interactive when their slide is shown, needs vl-convert-python (default: {PRERENDER})'
+    )   
     args = parser.parse_args()
     
     
-    main(args.input_glob, args.output_dir, args.serve, args.watch, args.port)
+    main(
+        args.input_glob, args.output_dir, args.serve, args.watch, args.port, args.jobs, 
+        args.cache, args.warm, args.host, args.prerender
+    )